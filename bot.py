@@ -1,17 +1,25 @@
 import os
 import math
+import logging
+import html
+import re
+import queue
+import atexit
+import time
+from logging.handlers import QueueHandler, QueueListener
 import asyncio
-import traceback
-import json
 import sys
 import tempfile
 import shutil
-from typing import Dict, Any, Optional, Tuple, List
-from datetime import time as dt_time, datetime, timedelta, timezone
+from typing import Dict, Any, Optional, Tuple, List, Callable, Awaitable, NamedTuple, Iterable
+from datetime import time as dt_time, date, datetime, timedelta, timezone
 from pathlib import Path
+from zoneinfo import ZoneInfo
+from bisect import bisect_right
 
 import aiohttp
 from aiohttp import web
+import orjson
 
 import pandas as pd
 import numpy as np
@@ -24,6 +32,27 @@ try:
 except ImportError:
     TA_AVAILABLE = False
 
+# быстрый event loop (libuv); на Windows и без пакета — стандартный asyncio
+try:
+    import uvloop
+    UVLOOP_AVAILABLE = True
+except ImportError:
+    UVLOOP_AVAILABLE = False
+
+# JIT для скана алертов; без пакета то же ядро работает на чистом numpy
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# пейсинг исходящих сообщений под лимиты Telegram (extra python-telegram-bot[rate-limiter])
+try:
+    import aiolimiter
+    RATE_LIMITER_AVAILABLE = True
+except ImportError:
+    RATE_LIMITER_AVAILABLE = False
+
 from telegram import (
     Update,
     ReplyKeyboardMarkup,
@@ -34,6 +63,7 @@ from telegram import (
 from telegram.ext import (
     Application,
     ApplicationBuilder,
+    AIORateLimiter,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
@@ -42,16 +72,39 @@ from telegram.ext import (
     filters,
 )
 
+from telegram.error import TelegramError
+from telegram.request import HTTPXRequest
+
 from openai import AsyncOpenAI
 
+# логгер: форматирование ленивое (%s), поэтому debug-строки из горячих циклов
+# в проде (LOG_LEVEL=WARNING) стоят одну проверку isEnabledFor.
+# Запись в stderr уходит в поток QueueListener: event loop только кладёт
+# запись в очередь и не блокируется на выводе (в т.ч. трейсбеков).
+_log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+_log_listener = QueueListener(_log_queue, _log_stream, respect_handler_level=True)
+_log_enqueue = QueueHandler(_log_queue)
+_log_enqueue.setFormatter(logging.Formatter("%(message)s"))  # полный формат — на стороне слушателя
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    handlers=[_log_enqueue],
+)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+# httpx на INFO пишет каждый запрос к Bot API с полным URL — а в нём токен бота
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logger = logging.getLogger("bot")
+
 # После строки FINNHUB_API_KEY = os.getenv("FINNHUB_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 if OPENAI_API_KEY:
-    print("✅ OPENAI_API_KEY: Set")
+    logger.info("✅ OPENAI_API_KEY: Set")
     openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 else:
-    print("⚠ OPENAI_API_KEY not set - AI advisor будет недоступен")
+    logger.warning("⚠ OPENAI_API_KEY not set - AI advisor будет недоступен")
     openai_client = None
     
 # =========================================================
@@ -68,18 +121,21 @@ if not TOKEN:
     raise RuntimeError("⚠ BOT_TOKEN is not set in environment!")
 
 if not CHAT_ID:
-    print("⚠ CHAT_ID не установлен - суммарные алерты в общий чат будут пропущены")
+    logger.warning("⚠ CHAT_ID не установлен - суммарные алерты в общий чат будут пропущены")
 
 if FINNHUB_API_KEY:
-    print("✅ FINNHUB_API_KEY: Set")
+    logger.info("✅ FINNHUB_API_KEY: Set")
 else:
-    print("⚠ FINNHUB_API_KEY not set - /events будет ограничен")
+    logger.warning("⚠ FINNHUB_API_KEY not set - /events будет ограничен")
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
     "Accept": "application/json",
 }
-TIMEOUT = aiohttp.ClientTimeout(total=15)
+TIMEOUT = aiohttp.ClientTimeout(total=15, connect=5)
+
+# локальное время для меток в сообщениях; ZoneInfo сам учитывает летнее время (UTC+2/UTC+3)
+RIGA_TZ = ZoneInfo("Europe/Riga")
 
 # тикеры фондового рынка / ETF / индекс
 AVAILABLE_TICKERS = {
@@ -129,12 +185,35 @@ CRYPTO_IDS = {
     },
 }
 
-# алерты
-THRESHOLDS = {
-    "stocks": 1.0,   # %
-    "crypto": 4.0,   # %
+# справочник отображения по любому ключу актива (акция или крипта): одно обращение к dict
+ASSET_NAMES: Dict[str, str] = {
+    **{t: info["name"] for t, info in AVAILABLE_TICKERS.items()},
+    **{s: info["name"] for s, info in CRYPTO_IDS.items()},
+}
+# то же для parse_mode="HTML": "S&P 500" и т.п. экранируем один раз при импорте
+ASSET_NAMES_HTML: Dict[str, str] = {k: html.escape(v, quote=False) for k, v in ASSET_NAMES.items()}
+ASSET_EMOJI: Dict[str, str] = {
+    **{t: "📊" for t in AVAILABLE_TICKERS},
+    **{s: "₿" for s in CRYPTO_IDS},
+}
+
+# грубые курсы к USD для сводной стоимости портфеля (остальное считаем как USD)
+FX_TO_USD = {"USD": 1.0, "EUR": 1.1}
+
+# стартовый портфель нового пользователя; отдаём копию, т.к. дальше его меняют
+DEFAULT_PORTFOLIO: Dict[str, float] = {
+    "VWCE.DE": 0,
+    "DE000A2T5DZ1.SG": 0,
+    "BTC": 0,
+    "ETH": 0,
+    "SOL": 0,
 }
 
+# алерты
+STOCK_THRESHOLD = 1.0   # %
+CRYPTO_THRESHOLD = 4.0  # %
+ALERT_INTERVAL = 600    # сек, тик джобы алертов (10 минут)
+
 # профили инвестора
 INVESTOR_TYPES = {
     "long": {
@@ -186,6 +265,8 @@ SIGNAL_THRESHOLDS = {
 user_portfolios: Dict[int, Dict[str, float]] = {}
 user_trades: Dict[int, List[Dict[str, Any]]] = {}
 user_profiles: Dict[int, str] = {}
+# юзеры, выбравшие компактный /all_prices: строки вместо <pre>-таблиц с рамками
+user_compact_view: set[int] = set()
 
 SELECT_CRYPTO, ENTER_AMOUNT, ENTER_PRICE, ENTER_TARGET = range(4)
 SELECT_ASSET_TYPE, SELECT_ASSET, ENTER_ASSET_AMOUNT = range(4, 7)
@@ -210,13 +291,33 @@ def get_data_directory() -> Path:
             test_file = d / ".write_test"
             test_file.write_text("test")
             test_file.unlink()
-            print(f"✅ Using data directory: {d}")
+            logger.info("✅ Using data directory: %s", d)
             return d
         except (OSError, PermissionError) as e:
-            print(f"⚠️ Cannot use {d}: {e}")
+            logger.warning("⚠️ Cannot use %s: %s", d, e)
             continue
     raise RuntimeError("❌ No writable data directory")
 
+def _dumps_pretty(obj: Any) -> str:
+    """orjson вместо json.dumps(indent=2): тот же формат, в разы быстрее.
+    OPT_NON_STR_KEYS — user_id у нас int, stdlib молча делал из них строки"""
+    return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
+
+def _atomic_write_text(path: Path, payload: str) -> bool:
+    """запись через .tmp + move, чтобы не оставить полуфайл; True если получилось"""
+    tmp = path.with_suffix(".tmp")
+    try:
+        tmp.write_text(payload)
+        shutil.move(str(tmp), str(path))
+        return True
+    except Exception as e:
+        logger.warning("⚠️ %s save err: %s", path.name, e)
+        try:
+            tmp.unlink(missing_ok=True)
+        except:
+            pass
+        return False
+
 DATA_DIR = get_data_directory()
 CACHE_FILE = DATA_DIR / "price_cache.json"
 PORTFOLIO_FILE = DATA_DIR / "portfolios.json"
@@ -230,41 +331,39 @@ class SupabaseStorage:
     def __init__(self, url: Optional[str], key: Optional[str]):
         self.url = url
         self.key = key
-        self.session: Optional[aiohttp.ClientSession] = None
         self.enabled = bool(url and key)
         if self.enabled:
             self.headers = {
                 "apikey": key,
                 "Authorization": f"Bearer {key}",
+                # тела запросов шлём готовыми байтами orjson, тип задаём сами
                 "Content-Type": "application/json",
                 "Prefer": "return=minimal",
             }
-            print("✅ Supabase storage enabled")
+            logger.info("✅ Supabase storage enabled")
         else:
             self.headers = {}
-            print("⚠️ Supabase storage disabled")
+            logger.warning("⚠️ Supabase storage disabled")
 
     async def _get_session(self) -> aiohttp.ClientSession:
-        if self.session is None or self.session.closed:
-            self.session = aiohttp.ClientSession()
-        return self.session
-
-    async def close(self):
-        if self.session and not self.session.closed:
-            await self.session.close()
+        # общий пул процесса (DNS-кэш, keep-alive); закрывается в close_session()
+        return await get_session()
 
     async def load_portfolios(self) -> Dict[int, Dict[str, float]]:
+        """все портфели на старте; тянем только нужные колонки, а не select=*"""
         if not self.enabled:
             return {}
         try:
             s = await self._get_session()
-            url = f"{self.url}/rest/v1/portfolios?select=*"
-            async with s.get(url, headers=self.headers, timeout=aiohttp.ClientTimeout(total=10)) as resp:
+            url = f"{self.url}/rest/v1/portfolios"
+            params = {"select": "user_id,assets"}
+            async with s.get(url, headers=self.headers, params=params,
+                             timeout=aiohttp.ClientTimeout(total=10)) as resp:
                 if resp.status != 200:
                     body = await resp.text()
-                    print(f"⚠️ load_portfolios HTTP {resp.status} {body[:200]}")
+                    logger.warning("⚠️ load_portfolios HTTP %s %s", resp.status, body[:200])
                     return {}
-                data = await resp.json()
+                data = await resp.json(loads=orjson.loads)
                 result: Dict[int, Dict[str, float]] = {}
                 for row in data:
                     try:
@@ -273,11 +372,11 @@ class SupabaseStorage:
                         if isinstance(assets, dict):
                             result[uid] = assets
                     except Exception as e:
-                        print(f"⚠️ bad portfolio row: {e}")
-                print(f"✅ Loaded {len(result)} portfolios from Supabase")
+                        logger.warning("⚠️ bad portfolio row: %s", e)
+                logger.info("✅ Loaded %s portfolios from Supabase", len(result))
                 return result
         except Exception as e:
-            print(f"⚠️ load_portfolios err: {e}")
+            logger.warning("⚠️ load_portfolios err: %s", e)
             return {}
 
     async def save_portfolio(self, user_id: int, assets: Dict[str, float]):
@@ -292,26 +391,30 @@ class SupabaseStorage:
                 "updated_at": datetime.utcnow().isoformat(),
             }
             headers = {**self.headers, "Prefer": "resolution=merge-duplicates"}
-            async with s.post(url, headers=headers, json=data,
+            async with s.post(url, headers=headers, data=orjson.dumps(data),
                               timeout=aiohttp.ClientTimeout(total=5)) as resp:
                 if resp.status not in (200, 201, 204):
                     body = await resp.text()
-                    print(f"⚠️ save_portfolio HTTP {resp.status} {body[:200]}")
+                    logger.warning("⚠️ save_portfolio HTTP %s %s", resp.status, body[:200])
         except Exception as e:
-            print(f"⚠️ save_portfolio err: {e}")
+            logger.warning("⚠️ save_portfolio err: %s", e)
 
     async def load_trades(self) -> Dict[int, List[Dict[str, Any]]]:
         if not self.enabled:
             return {}
         try:
             s = await self._get_session()
-            url = f"{self.url}/rest/v1/trades?select=*&order=created_at.desc"
+            url = (
+                f"{self.url}/rest/v1/trades"
+                "?select=id,user_id,symbol,amount,entry_price,target_profit_pct,notified,created_at"
+                "&order=created_at.desc"
+            )
             async with s.get(url, headers=self.headers, timeout=aiohttp.ClientTimeout(total=10)) as resp:
                 if resp.status != 200:
                     body = await resp.text()
-                    print(f"⚠️ load_trades HTTP {resp.status} {body[:200]}")
+                    logger.warning("⚠️ load_trades HTTP %s %s", resp.status, body[:200])
                     return {}
-                rows = await resp.json()
+                rows = await resp.json(loads=orjson.loads)
                 out: Dict[int, List[Dict[str, Any]]] = {}
                 for row in rows:
                     try:
@@ -326,11 +429,11 @@ class SupabaseStorage:
                             "timestamp": row.get("created_at", datetime.utcnow().isoformat()),
                         })
                     except Exception as e:
-                        print(f"⚠️ bad trade row: {e}")
-                print(f"✅ Loaded {sum(len(v) for v in out.values())} trades from Supabase")
+                        logger.warning("⚠️ bad trade row: %s", e)
+                logger.info("✅ Loaded %s trades from Supabase", sum(len(v) for v in out.values()))
                 return out
         except Exception as e:
-            print(f"⚠️ load_trades err: {e}")
+            logger.warning("⚠️ load_trades err: %s", e)
             return {}
 
     async def add_trade(
@@ -353,15 +456,15 @@ class SupabaseStorage:
                 "entry_price": entry_price,
                 "target_profit_pct": target_profit_pct,
             }
-            async with s.post(url, headers=self.headers, json=data,
+            async with s.post(url, headers=self.headers, data=orjson.dumps(data),
                               timeout=aiohttp.ClientTimeout(total=5)) as resp:
                 if resp.status in (200, 201, 204):
                     return True
                 body = await resp.text()
-                print(f"⚠️ add_trade HTTP {resp.status} {body[:200]}")
+                logger.warning("⚠️ add_trade HTTP %s %s", resp.status, body[:200])
                 return False
         except Exception as e:
-            print(f"⚠️ add_trade err: {e}")
+            logger.warning("⚠️ add_trade err: %s", e)
             return False
 
     async def update_trade_notified(self, trade_id: int):
@@ -371,13 +474,13 @@ class SupabaseStorage:
             s = await self._get_session()
             url = f"{self.url}/rest/v1/trades?id=eq.{trade_id}"
             data = {"notified": True}
-            async with s.patch(url, headers=self.headers, json=data,
+            async with s.patch(url, headers=self.headers, data=orjson.dumps(data),
                                timeout=aiohttp.ClientTimeout(total=5)) as resp:
                 if resp.status not in (200, 204):
                     body = await resp.text()
-                    print(f"⚠️ update_trade_notified HTTP {resp.status} {body[:200]}")
+                    logger.warning("⚠️ update_trade_notified HTTP %s %s", resp.status, body[:200])
         except Exception as e:
-            print(f"⚠️ update_trade_notified err: {e}")
+            logger.warning("⚠️ update_trade_notified err: %s", e)
 
 supabase_storage = SupabaseStorage(SUPABASE_URL, SUPABASE_KEY)
 
@@ -385,11 +488,16 @@ supabase_storage = SupabaseStorage(SUPABASE_URL, SUPABASE_KEY)
 # ======================  PRICE CACHE  ====================
 # =========================================================
 
+# база алертов из price_cache.json старше суток после рестарта уже не сравниваем
+ALERT_BASELINE_MAX_AGE = 86400
+
 class PriceCache:
-    def __init__(self, ttl_seconds: int = 300):
+    def __init__(self, ttl_seconds: int = 300, max_entries: int = 500):
         self.ttl = ttl_seconds
+        self.max_entries = max_entries
         self.cache: Dict[str, Dict] = {}
         self.stats = {"api_calls": 0, "cache_hits": 0}
+        self._dirty = False  # есть изменения, которых ещё нет на диске
         self.load()
 
     def load(self):
@@ -397,11 +505,11 @@ class PriceCache:
             return
         try:
             raw = CACHE_FILE.read_text()
-            data = json.loads(raw)
+            data = orjson.loads(raw)
             if not isinstance(data, dict):
-                print("⚠️ Invalid cache file structure")
+                logger.warning("⚠️ Invalid cache file structure")
                 return
-            now_ts = datetime.now().timestamp()
+            now_ts = time.time()
             valid = 0
             for k, v in data.items():
                 if not isinstance(v, dict):
@@ -413,60 +521,101 @@ class PriceCache:
                     ts = float(ts)
                 except (TypeError, ValueError):
                     continue
-                # не тащим совсем древнее
-                if now_ts - ts < self.ttl * 2:
+                # не тащим совсем древнее; база алертов живёт дольше обычных цен —
+                # ради неё файл и переживает рестарт
+                if k.startswith("alert_"):
+                    max_age = ALERT_BASELINE_MAX_AGE
+                else:
+                    max_age = max(self.ttl, v.get("ttl") or 0) * 2
+                if now_ts - ts < max_age:
                     self.cache[k] = v
                     valid += 1
-            print(f"✅ Loaded {valid} cached entries")
+            logger.info("✅ Loaded %s cached entries", valid)
         except Exception as e:
-            print(f"⚠️ cache load err: {e}")
+            logger.warning("⚠️ cache load err: %s", e)
 
     def save(self):
-        tmp = CACHE_FILE.with_suffix(".tmp")
+        """синхронная запись (shutdown); no-op, если с прошлой записи ничего не менялось"""
+        if not self._dirty:
+            return
+        self._dirty = False
+        payload = self._serialize()
+        if payload is not None:
+            self._write(payload)
+
+    async def save_async(self):
+        """то же, но запись файла в executor, чтобы не стопорить event loop"""
+        if not self._dirty:
+            return
+        self._dirty = False
+        # сериализуем здесь, пока никто не меняет cache; в поток уходит готовая строка
+        payload = self._serialize()
+        if payload is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, payload)
+
+    def _serialize(self) -> Optional[str]:
         try:
-            tmp.write_text(json.dumps(self.cache, indent=2))
-            shutil.move(str(tmp), str(CACHE_FILE))
+            return _dumps_pretty(self.cache)
         except Exception as e:
-            print(f"⚠️ cache save err: {e}")
-            try:
-                tmp.unlink(missing_ok=True)
-            except:
-                pass
+            logger.warning("⚠️ %s save err: %s", CACHE_FILE.name, e)
+            self._dirty = True  # попробуем в следующий раз
+            return None
+
+    def _write(self, payload: str):
+        if not _atomic_write_text(CACHE_FILE, payload):
+            self._dirty = True  # попробуем в следующий раз
 
     def _safe_price_ok(self, x: Any) -> bool:
         if not isinstance(x, (int, float)):
             return False
-        if math.isinf(x) or math.isnan(x) or x <= 0:
+        if not math.isfinite(x) or x <= 0:
             return False
         return True
 
+    def _effective_ttl(self, ttl: float) -> float:
+        """
+        TTL с поправкой на заполненность: до половины max_entries живём по полному ttl,
+        дальше линейно укорачиваем (но не меньше 10%), чтобы кэш сам себя разгружал
+        """
+        fill = len(self.cache) / self.max_entries
+        if fill <= 0.5:
+            return ttl
+        return ttl * max(0.1, 2.0 * (1.0 - fill))
+
     def get(self, key: str) -> Optional[Dict]:
         entry = self.cache.get(key)
         if not entry:
             return None
         try:
-            age = datetime.now().timestamp() - float(entry["timestamp"])
+            age = time.time() - float(entry["timestamp"])
         except Exception:
             self.cache.pop(key, None)
             return None
-        if age < self.ttl:
+        ttl = entry.get("ttl") or self.ttl
+        if age < self._effective_ttl(ttl):
             self.stats["cache_hits"] += 1
             return entry.get("data")
         return None
 
-    def set(self, key: str, data: Dict):
-        self.cache[key] = {
+    def set(self, key: str, data: Dict, ttl: Optional[float] = None):
+        """ttl: своё время жизни для ключа (сек), None -> общий self.ttl"""
+        entry: Dict[str, Any] = {
             "data": data,
-            "timestamp": datetime.now().timestamp(),
+            "timestamp": time.time(),
         }
+        if ttl is not None:
+            entry["ttl"] = ttl
+        self.cache[key] = entry
         self.stats["api_calls"] += 1
-        if len(self.cache) % 10 == 0:
-            self.save()
+        self._dirty = True
 
-    def get_for_alert(self, key: str) -> Optional[float]:
+    def get_for_alert(self, key: str, max_age: Optional[float] = None) -> Optional[float]:
+        """max_age: базу старше (сек) считаем протухшей и не отдаём"""
         entry = self.cache.get(key)
         if not entry:
             return None
+        if max_age is not None and time.time() - entry.get("timestamp", 0) > max_age:
+            return None
         price_val = entry.get("data", {}).get("price")
         if not self._safe_price_ok(price_val):
             return None
@@ -474,12 +623,29 @@ class PriceCache:
 
     def set_for_alert(self, key: str, price: float):
         if not self._safe_price_ok(price):
-            print(f"⚠️ invalid alert price for {key}: {price}")
+            logger.warning("⚠️ invalid alert price for %s: %s", key, price)
             return
         if key not in self.cache:
-            self.cache[key] = {"data": {}, "timestamp": datetime.now().timestamp()}
+            self.cache[key] = {"data": {}, "timestamp": time.time()}
         self.cache[key]["data"]["price"] = float(price)
-        self.save()
+        self.cache[key]["timestamp"] = time.time()
+        self._dirty = True
+
+    def swap_for_alert(self, key: str, price: float) -> Optional[float]:
+        """get_for_alert + set_for_alert за один проход по dict: пишет новую цену, возвращает прежнюю"""
+        entry = self.cache.get(key)
+        old = entry.get("data", {}).get("price") if entry else None
+        old_price = float(old) if self._safe_price_ok(old) else None
+        if not self._safe_price_ok(price):
+            logger.warning("⚠️ invalid alert price for %s: %s", key, price)
+            return old_price
+        now_ts = time.time()
+        if entry is None:
+            entry = self.cache[key] = {"data": {}, "timestamp": now_ts}
+        entry.setdefault("data", {})["price"] = float(price)
+        entry["timestamp"] = now_ts  # возраст базы — от последнего обновления, а не от создания
+        self._dirty = True
+        return old_price
 
     def get_stats(self) -> str:
         total = self.stats["api_calls"] + self.stats["cache_hits"]
@@ -493,6 +659,15 @@ class PriceCache:
 
 price_cache = PriceCache(ttl_seconds=300)
 
+# время жизни по типу данных: F&G обновляется раз в сутки, крипта — постоянно
+FEAR_GREED_TTL = 3600
+FEAR_GREED_MIN_TTL = 60
+FEAR_GREED_MAX_TTL = 86400
+CRYPTO_PRICE_TTL = 30
+STOCK_PRICE_TTL_OPEN = 60
+STOCK_PRICE_TTL_CLOSED = 1800
+TA_TTL = 900
+
 # =========================================================
 # ============ LOAD / SAVE USER DATA (LOCAL+REMOTE) =======
 # =========================================================
@@ -503,7 +678,7 @@ def _fallback_local_load():
     if not user_portfolios and PORTFOLIO_FILE.exists():
         try:
             raw = PORTFOLIO_FILE.read_text()
-            data = json.loads(raw)
+            data = orjson.loads(raw)
             tmp: Dict[int, Dict[str, float]] = {}
             if isinstance(data, dict):
                 for k, v in data.items():
@@ -514,15 +689,15 @@ def _fallback_local_load():
                     except Exception:
                         pass
             user_portfolios = tmp
-            print(f"✅ Loaded {len(user_portfolios)} portfolios from local file")
+            logger.info("✅ Loaded %s portfolios from local file", len(user_portfolios))
         except Exception as e:
-            print(f"⚠️ local portfolio load err: {e}")
+            logger.warning("⚠️ local portfolio load err: %s", e)
 
     # trades
     if not user_trades and TRADES_FILE.exists():
         try:
             raw = TRADES_FILE.read_text()
-            data = json.loads(raw)
+            data = orjson.loads(raw)
             tmp2: Dict[int, List[Dict[str, Any]]] = {}
             if isinstance(data, dict):
                 for k, v in data.items():
@@ -533,9 +708,9 @@ def _fallback_local_load():
                     except Exception:
                         pass
             user_trades = tmp2
-            print(f"✅ Loaded {len(user_trades)} trade lists from local file")
+            logger.info("✅ Loaded %s trade lists from local file", len(user_trades))
         except Exception as e:
-            print(f"⚠️ local trades load err: {e}")
+            logger.warning("⚠️ local trades load err: %s", e)
 
 async def load_data_on_start():
     global user_portfolios, user_trades
@@ -544,40 +719,37 @@ async def load_data_on_start():
         if sp_pf:
             user_portfolios = sp_pf
     except Exception as e:
-        print(f"⚠️ init portfolios err: {e}")
+        logger.warning("⚠️ init portfolios err: %s", e)
 
     try:
         sp_tr = await supabase_storage.load_trades()
         if sp_tr:
             user_trades = sp_tr
     except Exception as e:
-        print(f"⚠️ init trades err: {e}")
+        logger.warning("⚠️ init trades err: %s", e)
 
     _fallback_local_load()
 
 def save_portfolios_local():
-    try:
-        tmp = PORTFOLIO_FILE.with_suffix(".tmp")
-        tmp.write_text(json.dumps(user_portfolios, indent=2))
-        shutil.move(str(tmp), str(PORTFOLIO_FILE))
-    except Exception as e:
-        print(f"⚠️ portfolio save err: {e}")
-        try:
-            tmp.unlink(missing_ok=True)
-        except:
-            pass
+    _atomic_write_text(PORTFOLIO_FILE, _dumps_pretty(user_portfolios))
 
 def save_trades_local():
-    try:
-        tmp = TRADES_FILE.with_suffix(".tmp")
-        tmp.write_text(json.dumps(user_trades, indent=2))
-        shutil.move(str(tmp), str(TRADES_FILE))
-    except Exception as e:
-        print(f"⚠️ trades save err: {e}")
-        try:
-            tmp.unlink(missing_ok=True)
-        except:
-            pass
+    _atomic_write_text(TRADES_FILE, _dumps_pretty(user_trades))
+
+# по локу на файл: у записей общий .tmp, и порядок записей должен сохраняться
+_file_locks: Dict[Path, asyncio.Lock] = {}
+
+async def _write_json_async(path: Path, obj: Any):
+    """сериализация в loop, запись файла в executor"""
+    async with _file_locks.setdefault(path, asyncio.Lock()):
+        payload = _dumps_pretty(obj)
+        await asyncio.get_running_loop().run_in_executor(None, _atomic_write_text, path, payload)
+
+async def save_portfolios_local_async():
+    await _write_json_async(PORTFOLIO_FILE, user_portfolios)
+
+async def save_trades_local_async():
+    await _write_json_async(TRADES_FILE, user_trades)
 
 def _track_bg_task(coro: asyncio.Future):
     """ helper: оборачиваем create_task так, чтобы таски попадали в active_tasks и снимались по завершению """
@@ -590,14 +762,14 @@ def _track_bg_task(coro: asyncio.Future):
 def save_portfolio_hybrid(user_id: int, portfolio: Dict[str, float]):
     # в память
     user_portfolios[user_id] = portfolio
-    # на диск
-    save_portfolios_local()
+    # на диск — в фоне, диск не блокирует event loop хендлера
+    _track_bg_task(save_portfolios_local_async())
     # supabase async
     async def _push():
         try:
             await supabase_storage.save_portfolio(user_id, portfolio)
         except Exception as e:
-            print(f"⚠️ Background save_portfolio error: {e}")
+            logger.warning("⚠️ Background save_portfolio error: %s", e)
     _track_bg_task(_push())
 
 def add_trade_hybrid(
@@ -617,7 +789,7 @@ def add_trade_hybrid(
         "notified": False,
     }
     trades.append(trade)
-    save_trades_local()
+    _track_bg_task(save_trades_local_async())
 
     async def _push():
         try:
@@ -625,39 +797,99 @@ def add_trade_hybrid(
                 user_id, symbol, amount, entry_price, target_profit_pct
             )
         except Exception as e:
-            print(f"⚠️ Background add_trade error: {e}")
+            logger.warning("⚠️ Background add_trade error: %s", e)
     _track_bg_task(_push())
 
 # =========================================================
 # ================== PRICE FETCH HELPERS ==================
 # =========================================================
 
+# одна HTTP-сессия на весь процесс: keep-alive + пул соединений вместо
+# нового TCP/TLS рукопожатия на каждую команду и каждый тик алертов
+_http_session: Optional[aiohttp.ClientSession] = None
+
+async def get_session() -> aiohttp.ClientSession:
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=100,
+            limit_per_host=8,  # потолок; лимиты по апстримам — в HOST_SEMAPHORES
+            ttl_dns_cache=300,
+            enable_cleanup_closed=True,
+        )
+        _http_session = aiohttp.ClientSession(connector=connector, timeout=TIMEOUT)
+    return _http_session
+
+# у каждого апстрима свой rate limit: запросы к разным хостам идут параллельно,
+# а к одному хосту — не больше N одновременно (вместо sleep-пауз между запросами)
+HOST_SEMAPHORES: Dict[str, asyncio.Semaphore] = {
+    "yahoo": asyncio.Semaphore(4),
+    "binance": asyncio.Semaphore(8),
+    "coinpaprika": asyncio.Semaphore(8),  # режет на 10 req/s
+    "coingecko": asyncio.Semaphore(2),    # бесплатный тариф самый жёсткий
+}
+
+async def close_session():
+    global _http_session
+    if _http_session and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
 async def get_json(session: aiohttp.ClientSession, url: str, params=None) -> Optional[Dict[str, Any]]:
     try:
         async with session.get(url, params=params, headers=HEADERS, timeout=TIMEOUT) as r:
             if r.status != 200:
-                print(f"⚠ {url} -> HTTP {r.status}")
+                logger.warning("⚠ %s -> HTTP %s", url, r.status)
                 return None
-            return await r.json()
+            return orjson.loads(await r.read())
     except Exception as e:
-        print(f"❌ get_json({url}) error: {e}")
+        logger.error("❌ get_json(%s) error: %s", url, e)
         return None
 
+# single-flight: пока запрос по ключу в полёте, остальные вызовы ждут его же результат
+_inflight: Dict[str, asyncio.Task] = {}
+
+async def _single_flight(key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(factory())
+        _inflight[key] = task
+        task.add_done_callback(lambda _t: _inflight.pop(key, None))
+    # shield: отмена одного ожидающего не должна рвать общий запрос
+    return await asyncio.shield(task)
+
+async def _gather_quiet(*aws) -> List[Any]:
+    """asyncio.gather по независимым запросам: упавшая задача -> None, остальные не страдают"""
+    results = await asyncio.gather(*aws, return_exceptions=True)
+    out: List[Any] = []
+    for r in results:
+        if isinstance(r, BaseException):
+            logger.warning("⚠️ gather task failed: %r", r)
+            out.append(None)
+        else:
+            out.append(r)
+    return out
+
 def _safe_float(x: Any) -> Optional[float]:
+    """float(x) или None для мусора / NaN / inf — одна конверсия, одна проверка"""
     try:
         val = float(x)
-        if math.isnan(val) or math.isinf(val):
-            return None
-        return val
-    except Exception:
+    except (TypeError, ValueError, OverflowError):
         return None
+    return val if math.isfinite(val) else None
 
-async def get_yahoo_price(session: aiohttp.ClientSession, ticker: str) -> Optional[Tuple[float, str, float]]:
+def _positive_number(text: str) -> Optional[float]:
+    """ввод пользователя -> число > 0 или None (без исключений на частом 'не то ввёл')"""
+    val = _safe_float(text)
+    return val if val is not None and val > 0 else None
+
+async def get_yahoo_price_raw(session: aiohttp.ClientSession, ticker: str) -> Optional[Tuple[float, str, float]]:
     """returns (price, currency, change_pct_24h)"""
     try:
         url = f"https://query2.finance.yahoo.com/v8/finance/chart/{ticker}"
         params = {"interval": "1d", "range": "1d"}
-        data = await get_json(session, url, params)
+        async with HOST_SEMAPHORES["yahoo"]:
+            data = await get_json(session, url, params)
         if not data:
             return None
 
@@ -676,22 +908,135 @@ async def get_yahoo_price(session: aiohttp.ClientSession, ticker: str) -> Option
         return (price, cur, change_pct)
 
     except Exception as e:
-        print(f"❌ Yahoo {ticker} error: {e}")
+        logger.error("❌ Yahoo %s error: %s", ticker, e)
         return None
 
-async def get_crypto_price_raw(session: aiohttp.ClientSession, symbol: str) -> Optional[Dict[str, Any]]:
-    info = CRYPTO_IDS.get(symbol)
-    if not info:
-        return None
+def _stock_price_ttl() -> int:
+    """В торговые часы (будни, от открытия XETRA до закрытия US) котировки живут минуту, иначе полчаса"""
+    now = datetime.now(timezone.utc)
+    if now.weekday() < 5 and 7 <= now.hour < 21:
+        return STOCK_PRICE_TTL_OPEN
+    return STOCK_PRICE_TTL_CLOSED
+
+async def get_yahoo_price(
+    session: aiohttp.ClientSession,
+    ticker: str,
+    use_cache: bool = True,
+) -> Optional[Tuple[float, str, float]]:
+    """как get_yahoo_price_raw, но через price_cache (use_cache=False -> всегда свежая цена)"""
+    cache_key = f"stock_{ticker}"
+    if use_cache:
+        cached = price_cache.get(cache_key)
+        if cached:
+            return cached["price"], cached["currency"], cached["change_pct"]
+
+    async def _fetch():
+        raw = await get_yahoo_price_raw(session, ticker)
+        if raw:
+            price, cur, chg = raw
+            price_cache.set(
+                cache_key,
+                {"price": price, "currency": cur, "change_pct": chg},
+                ttl=_stock_price_ttl(),
+            )
+        return raw
+
+    return await _single_flight(cache_key, _fetch)
+
+YAHOO_QUOTE_URL = "https://query2.finance.yahoo.com/v7/finance/quote"
+# v7 /quote иногда требует crumb-куку и отвечает 401 — тогда на час
+# перестаём его дёргать и берём котировки поштучно через v8 chart
+YAHOO_BATCH_BACKOFF = 3600
+_yahoo_batch_retry_at = 0.0
+
+async def get_yahoo_prices_batch(
+    session: aiohttp.ClientSession,
+    tickers: List[str],
+) -> Dict[str, Tuple[float, str, float]]:
+    """все тикеры одним запросом v7 /quote?symbols=a,b,c -> {ticker: (price, currency, change_pct)}"""
+    global _yahoo_batch_retry_at
+    if not tickers or time.time() < _yahoo_batch_retry_at:
+        return {}
+
+    symbols = ",".join(tickers)
+
+    async def _batch():
+        async with HOST_SEMAPHORES["yahoo"]:
+            return await get_json(session, YAHOO_QUOTE_URL, {"symbols": symbols})
+
+    data = await _single_flight(f"yahoo_batch_{symbols}", _batch)
+    try:
+        quotes = data["quoteResponse"]["result"]
+    except (TypeError, KeyError):
+        quotes = None
+    if not quotes:
+        _yahoo_batch_retry_at = time.time() + YAHOO_BATCH_BACKOFF
+        logger.info("ℹ️ Yahoo batch quote unavailable, per-ticker fallback for %ss", YAHOO_BATCH_BACKOFF)
+        return {}
+
+    out: Dict[str, Tuple[float, str, float]] = {}
+    for q in quotes:
+        ticker = q.get("symbol")
+        price = _safe_float(q.get("regularMarketPrice"))
+        if not ticker or price is None:
+            continue
+        change_pct = _safe_float(q.get("regularMarketChangePercent"))
+        out[ticker] = (price, q.get("currency", "USD"), change_pct if change_pct is not None else 0.0)
+    return out
+
+async def get_many_yahoo_prices(
+    session: aiohttp.ClientSession,
+    tickers: Iterable[str],
+    use_cache: bool = True,
+) -> Dict[str, Tuple[float, str, float]]:
+    """
+    Котировки сразу по нескольким тикерам: один запрос v7 /quote, а то,
+    чего там не оказалось, добираем поштучно через get_yahoo_price.
+    Возвращает {ticker: (price, currency, change_pct)} только для найденных.
+    """
+    out: Dict[str, Tuple[float, str, float]] = {}
+    missing: List[str] = []
+    for ticker in dict.fromkeys(tickers):
+        if use_cache:
+            cached = price_cache.get(f"stock_{ticker}")
+            if cached:
+                out[ticker] = (cached["price"], cached["currency"], cached["change_pct"])
+                continue
+        missing.append(ticker)
+
+    if not missing:
+        return out
+
+    # 1) Yahoo batch
+    ttl = _stock_price_ttl()
+    for ticker, (price, cur, chg) in (await get_yahoo_prices_batch(session, missing)).items():
+        if ticker in missing:
+            out[ticker] = (price, cur, chg)
+            price_cache.set(
+                f"stock_{ticker}",
+                {"price": price, "currency": cur, "change_pct": chg},
+                ttl=ttl,
+            )
+
+    # 2) поштучный fallback только для пропущенных (параллельно)
+    rest = [t for t in missing if t not in out]
+    if rest:
+        results = await _gather_quiet(
+            *(get_yahoo_price(session, t, use_cache=False) for t in rest)
+        )
+        for ticker, raw in zip(rest, results):
+            if raw:
+                out[ticker] = raw
+    return out
 
-    # 1) Binance
+async def _crypto_from_binance(session: aiohttp.ClientSession, symbol: str, info: Dict[str, str]) -> Optional[Dict[str, Any]]:
     try:
         binance_symbol = info["binance"]
         url = "https://api.binance.com/api/v3/ticker/24hr"
         params = {"symbol": binance_symbol}
-        async with session.get(url, params=params, timeout=TIMEOUT) as resp:
+        async with HOST_SEMAPHORES["binance"], session.get(url, params=params, timeout=TIMEOUT) as resp:
             if resp.status == 200:
-                data = await resp.json()
+                data = await resp.json(loads=orjson.loads)
                 price = _safe_float(data.get("lastPrice"))
                 chg = _safe_float(data.get("priceChangePercent"))
                 if price is not None and price > 0:
@@ -701,13 +1046,15 @@ async def get_crypto_price_raw(session: aiohttp.ClientSession, symbol: str) -> O
                         "source": "Binance",
                     }
     except Exception as e:
-        print(f"⚠️ Binance failed {symbol}: {e}")
+        logger.warning("⚠️ Binance failed %s: %s", symbol, e)
+    return None
 
-    # 2) CoinPaprika
+async def _crypto_from_paprika(session: aiohttp.ClientSession, symbol: str, info: Dict[str, str]) -> Optional[Dict[str, Any]]:
     try:
         paprika_id = info["paprika"]
         url = f"https://api.coinpaprika.com/v1/tickers/{paprika_id}"
-        data = await get_json(session, url, None)
+        async with HOST_SEMAPHORES["coinpaprika"]:
+            data = await get_json(session, url, None)
         if data:
             quotes = data.get("quotes", {}).get("USD", {})
             price = _safe_float(quotes.get("price"))
@@ -719,9 +1066,10 @@ async def get_crypto_price_raw(session: aiohttp.ClientSession, symbol: str) -> O
                     "source": "CoinPaprika",
                 }
     except Exception as e:
-        print(f"⚠️ CoinPaprika failed {symbol}: {e}")
+        logger.warning("⚠️ CoinPaprika failed %s: %s", symbol, e)
+    return None
 
-    # 3) CoinGecko
+async def _crypto_from_coingecko(session: aiohttp.ClientSession, symbol: str, info: Dict[str, str]) -> Optional[Dict[str, Any]]:
     try:
         cg_id = info["coingecko"]
         url = "https://api.coingecko.com/api/v3/simple/price"
@@ -730,7 +1078,8 @@ async def get_crypto_price_raw(session: aiohttp.ClientSession, symbol: str) -> O
             "vs_currencies": "usd",
             "include_24hr_change": "true",
         }
-        data = await get_json(session, url, params)
+        async with HOST_SEMAPHORES["coingecko"]:
+            data = await get_json(session, url, params)
         if data and cg_id in data:
             coin = data[cg_id]
             price = _safe_float(coin.get("usd"))
@@ -742,9 +1091,46 @@ async def get_crypto_price_raw(session: aiohttp.ClientSession, symbol: str) -> O
                     "source": "CoinGecko",
                 }
     except Exception as e:
-        print(f"⚠️ CoinGecko failed {symbol}: {e}")
+        logger.warning("⚠️ CoinGecko failed %s: %s", symbol, e)
+    return None
+
+# источники в порядке предпочтения
+CRYPTO_SOURCES = (_crypto_from_binance, _crypto_from_paprika, _crypto_from_coingecko)
+# сколько ждём текущие источники, прежде чем подключить следующий
+CRYPTO_HEDGE_DELAY = 1.5
+
+async def get_crypto_price_raw(session: aiohttp.ClientSession, symbol: str) -> Optional[Dict[str, Any]]:
+    """
+    Hedged-запрос: стартуем с Binance; если за CRYPTO_HEDGE_DELAY ответа нет
+    (или источник уже упал), параллельно запускаем следующий. Берём первый
+    успешный ответ, остальные отменяем. Медленный источник больше не держит
+    весь TIMEOUT, а в обычном случае уходит один запрос, не три.
+    """
+    info = CRYPTO_IDS.get(symbol)
+    if not info:
+        return None
 
-    print(f"❌ All sources failed for {symbol}")
+    pending: set = set()
+    try:
+        for source in CRYPTO_SOURCES:
+            pending.add(asyncio.create_task(source(session, symbol, info)))
+            done, pending = await asyncio.wait(
+                pending, timeout=CRYPTO_HEDGE_DELAY, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.result():
+                    return task.result()
+        # все источники запущены — ждём первый успешный из оставшихся
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.result():
+                    return task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+    logger.error("❌ All sources failed for %s", symbol)
     return None
 
 async def get_crypto_price(session: aiohttp.ClientSession, symbol: str, use_cache: bool = True) -> Optional[Dict[str, Any]]:
@@ -753,26 +1139,128 @@ async def get_crypto_price(session: aiohttp.ClientSession, symbol: str, use_cach
         cached = price_cache.get(cache_key)
         if cached:
             return cached
-    raw = await get_crypto_price_raw(session, symbol)
-    if raw:
-        price_cache.set(cache_key, raw)
-    return raw
+
+    async def _fetch():
+        raw = await get_crypto_price_raw(session, symbol)
+        if raw:
+            price_cache.set(cache_key, raw, ttl=CRYPTO_PRICE_TTL)
+        return raw
+
+    return await _single_flight(cache_key, _fetch)
+
+async def get_many_crypto_prices(
+    session: aiohttp.ClientSession,
+    symbols: Iterable[str],
+    use_cache: bool = True,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Цены сразу по нескольким монетам: один запрос CoinGecko /simple/price
+    с ids=a,b,c, затем один батч Binance /ticker/24hr?symbols=[...] для остатка,
+    и только то, чего нет и там, добираем поштучно через get_crypto_price.
+    Возвращает {symbol: {"usd", "change_24h", "source"}} только для найденных.
+    """
+    out: Dict[str, Dict[str, Any]] = {}
+    missing: List[str] = []
+    for sym in dict.fromkeys(symbols):
+        if sym not in CRYPTO_IDS:
+            continue
+        if use_cache:
+            cached = price_cache.get(f"crypto_{sym}")
+            if cached:
+                out[sym] = cached
+                continue
+        missing.append(sym)
+
+    if not missing:
+        return out
+
+    # 1) CoinGecko batch
+    cg_to_sym = {CRYPTO_IDS[s]["coingecko"]: s for s in missing}
+    try:
+        url = "https://api.coingecko.com/api/v3/simple/price"
+        params = {
+            "ids": ",".join(cg_to_sym),
+            "vs_currencies": "usd",
+            "include_24hr_change": "true",
+        }
+        async def _batch():
+            async with HOST_SEMAPHORES["coingecko"]:
+                return await get_json(session, url, params)
+
+        data = await _single_flight(f"coingecko_batch_{params['ids']}", _batch)
+        if data:
+            for cg_id, sym in cg_to_sym.items():
+                coin = data.get(cg_id)
+                if not isinstance(coin, dict):
+                    continue
+                price = _safe_float(coin.get("usd"))
+                chg = _safe_float(coin.get("usd_24h_change"))
+                if price is not None and price > 0:
+                    out[sym] = {
+                        "usd": price,
+                        "change_24h": chg,
+                        "source": "CoinGecko",
+                    }
+                    price_cache.set(f"crypto_{sym}", out[sym], ttl=CRYPTO_PRICE_TTL)
+    except Exception as e:
+        logger.warning("⚠️ CoinGecko batch failed %s: %s", missing, e)
+
+    # 2) Binance batch: один /ticker/24hr?symbols=[...] на всё, что не отдал CoinGecko
+    rest = [sym for sym in missing if sym not in out]
+    if rest:
+        pair_to_sym = {CRYPTO_IDS[s]["binance"]: s for s in rest}
+        try:
+            url = "https://api.binance.com/api/v3/ticker/24hr"
+            params = {"symbols": orjson.dumps(list(pair_to_sym)).decode()}
+            async with HOST_SEMAPHORES["binance"]:
+                data = await get_json(session, url, params)
+            for row in data if isinstance(data, list) else ():
+                sym = pair_to_sym.get(row.get("symbol"))
+                price = _safe_float(row.get("lastPrice"))
+                if sym and price is not None and price > 0:
+                    out[sym] = {
+                        "usd": price,
+                        "change_24h": _safe_float(row.get("priceChangePercent")),
+                        "source": "Binance",
+                    }
+                    price_cache.set(f"crypto_{sym}", out[sym], ttl=CRYPTO_PRICE_TTL)
+        except Exception as e:
+            logger.warning("⚠️ Binance batch failed %s: %s", rest, e)
+
+    # 3) поштучный fallback только для пропущенных (параллельно)
+    rest = [sym for sym in missing if sym not in out]
+    if rest:
+        results = await _gather_quiet(
+            *(get_crypto_price(session, sym, use_cache=False) for sym in rest)
+        )
+        for sym, raw in zip(rest, results):
+            if raw:
+                out[sym] = raw
+    return out
 
 async def get_fear_greed_index(session: aiohttp.ClientSession) -> Optional[int]:
     cache_key = "fear_greed"
     cached = price_cache.get(cache_key)
     if cached:
         return cached.get("value")
-    try:
-        url = "https://api.alternative.me/fng/"
-        data = await get_json(session, url, None)
-        if data and "data" in data:
-            value = int(data["data"][0]["value"])
-            price_cache.set(cache_key, {"value": value})
-            return value
-    except Exception as e:
-        print(f"❌ Fear & Greed error: {e}")
-    return None
+
+    async def _fetch() -> Optional[int]:
+        try:
+            url = "https://api.alternative.me/fng/"
+            data = await get_json(session, url, None)
+            if data and "data" in data:
+                row = data["data"][0]
+                value = int(row["value"])
+                # индекс обновляется раз в сутки: держим кэш ровно до следующего обновления
+                ttl = _safe_float(row.get("time_until_update")) or FEAR_GREED_TTL
+                ttl = min(max(ttl, FEAR_GREED_MIN_TTL), FEAR_GREED_MAX_TTL)
+                price_cache.set(cache_key, {"value": value}, ttl=ttl)
+                return value
+        except Exception as e:
+            logger.error("❌ Fear & Greed error: %s", e)
+        return None
+
+    return await _single_flight(cache_key, _fetch)
 
 # =========================================================
 # =========== HISTORICAL PRICE & TECHNICAL ANALYSIS =======
@@ -792,33 +1280,35 @@ async def get_price_history(session: aiohttp.ClientSession, symbol: str, days: i
     url = "https://api.binance.com/api/v3/klines"
     params = {"symbol": pair, "interval": "1d", "limit": min(days, 200)}
     try:
-        async with session.get(url, params=params, timeout=TIMEOUT) as resp:
+        async with HOST_SEMAPHORES["binance"], session.get(url, params=params, timeout=TIMEOUT) as resp:
             if resp.status != 200:
-                print(f"⚠️ klines {symbol} HTTP {resp.status}")
+                logger.warning("⚠️ klines %s HTTP %s", symbol, resp.status)
                 return None
-            raw = await resp.json()
+            raw = await resp.json(loads=orjson.loads)
     except Exception as e:
-        print(f"⚠️ klines {symbol} err: {e}")
+        logger.warning("⚠️ klines %s err: %s", symbol, e)
         return None
 
     # raw is list of lists:
     # [ openTime, open, high, low, close, volume, closeTime, ...]
+    # берём нужные колонки по индексу и конвертим их целиком,
+    # без datetime/tuple на каждую свечу
     try:
-        rows = []
-        for entry in raw:
-            ts = datetime.utcfromtimestamp(entry[0] / 1000.0)
-            close_p = _safe_float(entry[4])
-            vol = _safe_float(entry[5])
-            if close_p is None or vol is None:
-                continue
-            rows.append((ts, close_p, vol))
-        if not rows:
+        if not raw:
+            return None
+        ts = pd.to_datetime([entry[0] for entry in raw], unit="ms")
+        close_p = np.array([entry[4] for entry in raw], dtype=float)
+        vol = np.array([entry[5] for entry in raw], dtype=float)
+        ok = np.isfinite(close_p) & np.isfinite(vol)
+        if not ok.any():
             return None
-        df = pd.DataFrame(rows, columns=["ts", "close", "volume"])
-        df.set_index("ts", inplace=True)
+        df = pd.DataFrame(
+            {"close": close_p[ok], "volume": vol[ok]},
+            index=pd.Index(ts[ok], name="ts"),
+        )
         return df
     except Exception as e:
-        print(f"⚠️ klines parse {symbol} err: {e}")
+        logger.warning("⚠️ klines parse %s err: %s", symbol, e)
         return None
 
 def _norm(v: float, lo: float, hi: float, invert: bool = False) -> float:
@@ -832,6 +1322,22 @@ def _norm(v: float, lo: float, hi: float, invert: bool = False) -> float:
     return x * 100.0
 
 async def calculate_technical_indicators(session: aiohttp.ClientSession, symbol: str) -> Optional[Dict[str, Any]]:
+    """индикаторы по дневным свечам меняются медленно: кэш на TA_TTL + single-flight,
+    чтобы серия /signals не гоняла klines и pandas на каждый вызов"""
+    cache_key = f"ta_{symbol}"
+    cached = price_cache.get(cache_key)
+    if cached:
+        return cached
+
+    async def _fetch() -> Optional[Dict[str, Any]]:
+        result = await calculate_technical_indicators_raw(session, symbol)
+        if result:
+            price_cache.set(cache_key, result, ttl=TA_TTL)
+        return result
+
+    return await _single_flight(cache_key, _fetch)
+
+async def calculate_technical_indicators_raw(session: aiohttp.ClientSession, symbol: str) -> Optional[Dict[str, Any]]:
     """
     Возвращает dict:
     {
@@ -845,7 +1351,7 @@ async def calculate_technical_indicators(session: aiohttp.ClientSession, symbol:
     Если TA_AVAILABLE=False или данных не хватает -> None
     """
     if not TA_AVAILABLE:
-        print("TA not available (ta lib not imported)")
+        logger.debug("TA not available (ta lib not imported)")
         return None
 
     df = await get_price_history(session, symbol, days=200)
@@ -884,7 +1390,7 @@ async def calculate_technical_indicators(session: aiohttp.ClientSession, symbol:
     vol_spike = latest.get("vol_spike", np.nan)
 
     def _is_num(x):
-        return x is not None and not (isinstance(x, float) and (math.isnan(x) or math.isinf(x)))
+        return x is not None and not (isinstance(x, float) and not math.isfinite(x))
 
     # RSI state
     if _is_num(rsi_val):
@@ -900,7 +1406,7 @@ async def calculate_technical_indicators(session: aiohttp.ClientSession, symbol:
     # MACD bullish?
     macd_bullish = False
     if _is_num(macd_now) and _is_num(macd_sig):
-        macd_bullish = macd_now > macd_sig
+        macd_bullish = bool(macd_now > macd_sig)  # numpy.bool orjson не сериализует
 
     # Trend via SMA
     sma_short_above_long = False
@@ -933,32 +1439,32 @@ async def calculate_technical_indicators(session: aiohttp.ClientSession, symbol:
 # =========================================================
 
 def get_user_portfolio(user_id: int) -> Dict[str, float]:
-    if user_id not in user_portfolios:
-        user_portfolios[user_id] = {
-            "VWCE.DE": 0,
-            "DE000A2T5DZ1.SG": 0,
-            "BTC": 0,
-            "ETH": 0,
-            "SOL": 0,
-        }
-    return user_portfolios[user_id]
+    pf = user_portfolios.get(user_id)
+    if pf is None:
+        pf = user_portfolios[user_id] = DEFAULT_PORTFOLIO.copy()
+    return pf
+
+def peek_user_portfolio(user_id: int) -> Dict[str, float]:
+    """
+    Только для чтения: незнакомому пользователю не заводим нулевой портфель.
+    Иначе каждый просмотр /portfolio или /events записывал бы пустышку,
+    которая уезжает в portfolios.json и в каждый обход get_all_active_assets.
+    """
+    return user_portfolios.get(user_id) or {}
 
 def get_user_trades(uid: int) -> List[Dict[str, Any]]:
-    if uid not in user_trades:
-        user_trades[uid] = []
-    return user_trades[uid]
+    # только чтение; новые сделки добавляет add_trade_hybrid через setdefault
+    return user_trades.get(uid) or []
 
-def get_all_active_assets() -> Dict[str, List[int]]:
-    """Собирает активы, которые у кого-то реально есть (для алертов)"""
-    active_assets: Dict[str, List[int]] = {}
+def get_all_active_assets() -> Dict[str, set[int]]:
+    """Собирает активы, которые у кого-то реально есть (для алертов): {asset: {uid, ...}}"""
+    active_assets: Dict[str, set[int]] = {}
     # портфели
     for uid, pf in user_portfolios.items():
         for ticker, qty in pf.items():
             try:
                 if float(qty) > 0:
-                    active_assets.setdefault(ticker, [])
-                    if uid not in active_assets[ticker]:
-                        active_assets[ticker].append(uid)
+                    active_assets.setdefault(ticker, set()).add(uid)
             except Exception:
                 continue
     # сделки
@@ -967,43 +1473,78 @@ def get_all_active_assets() -> Dict[str, List[int]]:
             sym = t.get("symbol")
             if not sym:
                 continue
-            active_assets.setdefault(sym, [])
-            if uid not in active_assets[sym]:
-                active_assets[sym].append(uid)
+            active_assets.setdefault(sym, set()).add(uid)
     return active_assets
 
 # =========================================================
 # ================== MARKET SIGNAL LOGIC ==================
 # =========================================================
 
+# пороговые таблицы вместо if/elif-лесенок: границы по возрастанию,
+# значений на одно больше, чем границ; bisect_right -> индекс корзины
+# (граница включается в верхнюю корзину, как было в "if x >= порог")
+CONFIDENCE_BOUNDS = (35, 50, 65, 80)          # -> 1..5 звёзд
+SIGNAL_BOUNDS = (30, 45, 55, 70)
+SIGNAL_LABELS = (
+    ("STRONG SELL", "🔴🔴"),
+    ("SELL", "🔴"),
+    ("HOLD", "🟡"),
+    ("BUY", "🟢"),
+    ("STRONG BUY", "🟢🟢"),
+)
+# монеты для /signals и AI-советника, в порядке вывода
+SIGNAL_SYMBOLS = ("BTC", "ETH", "SOL", "AVAX")
+FEAR_GREED_BOUNDS = (25, 45, 55, 75)
+FEAR_GREED_LABELS = (
+    "😱 Экстремальный страх",
+    "😰 Страх",
+    "😐 Нейтрально",
+    "😃 Жадность",
+    "🤑 Экстремальная жадность",
+)
+
+EVENTS_MOOD_BOUNDS = (25, 45, 75)
+EVENTS_MOOD_LABELS = (
+    "😱 Экстремальный страх → часто хорошая точка входа для долгосрока",
+    "😰 Страх → рынок нервничает, можно подбирать понемногу",
+    "😃 Жадность → рынок оптимистичен",
+    "🤑 Экстремальная жадность → потенциал перегрева",
+)
+
+# баллы F&G по профилю: (ключ нижнего порога, ключ верхнего порога), (≤low, между, ≥high)
+FG_SCORE_BANDS = {
+    # swing хочет ловить коррекцию (ниже ~40) и фиксить >65, так что оптимально средне-низкий
+    "swing": (("buy_dip", "sell_pump"), (80.0, 60.0, 20.0)),
+    # day: он больше боится перекупа, но готов играть на импульсе
+    "day": (("scalp_buy", "scalp_sell"), (75.0, 55.0, 25.0)),
+}
+RSI_SCORES = (85.0, 55.0, 20.0)  # перепродан / середина / перекуплен
+
+def _band(value: float, lo: float, hi: float, scores: Tuple[float, float, float]) -> float:
+    """scores[0] если value <= lo, scores[2] если value >= hi, иначе scores[1]"""
+    return scores[(value > lo) + (value >= hi)]
+
 def _confidence_stars(score: float) -> str:
     # score 0..100 ⇒ 1-5 звёзд
-    if score >= 80:
-        stars = 5
-    elif score >= 65:
-        stars = 4
-    elif score >= 50:
-        stars = 3
-    elif score >= 35:
-        stars = 2
-    else:
-        stars = 1
-    return "⭐" * stars
+    return "⭐" * (1 + bisect_right(CONFIDENCE_BOUNDS, score))
 
 def _score_to_signal(score: float):
     # возвращает (label, emoji)
-    if score >= 70:
-        return "STRONG BUY", "🟢🟢"
-    if score >= 55:
-        return "BUY", "🟢"
-    if score >= 45:
-        return "HOLD", "🟡"
-    if score >= 30:
-        return "SELL", "🔴"
-    return "STRONG SELL", "🔴🔴"
-
-async def build_signal_for_symbol(session: aiohttp.ClientSession, symbol: str, investor_type: str) -> Dict[str, Any]:
+    return SIGNAL_LABELS[bisect_right(SIGNAL_BOUNDS, score)]
+
+def _fear_greed_status(fg_val: int) -> str:
+    return FEAR_GREED_LABELS[bisect_right(FEAR_GREED_BOUNDS, fg_val)]
+
+def _score_signal(
+    symbol: str,
+    investor_type: str,
+    fg_val: Optional[int],
+    ta_data: Optional[Dict[str, Any]],
+) -> Dict[str, Any]:
     """
+    Чистый расчёт сигнала по уже полученным F&G и TA (без сети).
+    fg_val None -> считаем нейтральным 50, ta_data None -> TA недоступен.
+
     Возвращает:
     {
       "symbol": "BTC",
@@ -1018,24 +1559,11 @@ async def build_signal_for_symbol(session: aiohttp.ClientSession, symbol: str, i
     reason_lines: List[str] = []
 
     # Fear & Greed
-    fg_val = await get_fear_greed_index(session)
     if fg_val is None:
         fg_val = 50
-    # интерпретация
-    if fg_val < 25:
-        fg_note = "😱 Экстремальный страх"
-    elif fg_val < 45:
-        fg_note = "😰 Страх"
-    elif fg_val < 55:
-        fg_note = "😐 Нейтрально"
-    elif fg_val < 75:
-        fg_note = "😃 Жадность"
-    else:
-        fg_note = "🤑 Экстремальная жадность"
-    reason_lines.append(f"Fear & Greed: {fg_val}/100 ({fg_note})")
+    reason_lines.append(f"Fear & Greed: {fg_val}/100 ({_fear_greed_status(fg_val)})")
 
     # TA
-    ta_data = await calculate_technical_indicators(session, symbol)
     if ta_data is None:
         ta_data = {
             "rsi": None,
@@ -1066,25 +1594,11 @@ async def build_signal_for_symbol(session: aiohttp.ClientSession, symbol: str, i
 
     # F&G score: для long чем ниже FG тем лучше (fear = good entry)
     # для day чем ближе к 50 тем лучше (волатильность => scalp)
-    if investor_type == "long":
-        fg_score = _norm(fg_val, 20, 80, invert=True)  # низкий F&G -> высокий балл
-    elif investor_type == "swing":
-        # swing хочет ловить коррекцию (ниже ~40) и фиксить >65, так что оптимально средне-низкий
-        # прибьем к 30..70
-        if fg_val <= th["buy_dip"]:
-            fg_score = 80.0
-        elif fg_val >= th["sell_pump"]:
-            fg_score = 20.0
-        else:
-            fg_score = 60.0
+    if investor_type in FG_SCORE_BANDS:
+        (lo_key, hi_key), fg_scores = FG_SCORE_BANDS[investor_type]
+        fg_score = _band(fg_val, th[lo_key], th[hi_key], fg_scores)
     else:
-        # day: он больше боится перекупа, но готов играть на импульсе
-        if fg_val <= th["scalp_buy"]:
-            fg_score = 75.0
-        elif fg_val >= th["scalp_sell"]:
-            fg_score = 25.0
-        else:
-            fg_score = 55.0
+        fg_score = _norm(fg_val, 20, 80, invert=True)  # long: низкий F&G -> высокий балл
     score_parts.append(("fg", fg_score, 30))
 
     # RSI score: low RSI => buy ; high RSI => sell
@@ -1093,15 +1607,12 @@ async def build_signal_for_symbol(session: aiohttp.ClientSession, symbol: str, i
         rsi_score = 50.0
     else:
         # если rsi низкий -> хорошо для покупки
-        low_thr = th.get("rsi_oversold", 30)
-        hi_thr = th.get("rsi_overbought", 70)
-        if rsi_val <= low_thr:
-            rsi_score = 85.0
-        elif rsi_val >= hi_thr:
-            rsi_score = 20.0
-        else:
-            # середина
-            rsi_score = 55.0
+        rsi_score = _band(
+            rsi_val,
+            th.get("rsi_oversold", 30),
+            th.get("rsi_overbought", 70),
+            RSI_SCORES,
+        )
     score_parts.append(("rsi", rsi_score, 25))
 
     # MACD bullish -> позитив
@@ -1142,6 +1653,219 @@ async def build_signal_for_symbol(session: aiohttp.ClientSession, symbol: str, i
 # ======================== ALERTS =========================
 # =========================================================
 
+async def fetch_all_prices(
+    session: aiohttp.ClientSession,
+    assets: Dict[str, Any],
+) -> Dict[str, Tuple[float, str]]:
+    """
+    Сетевая фаза алертов: каждый символ тянем ровно один раз
+    (акции параллельно, крипта одним батчем).
+    Возвращает {asset: (price, currency)}; то, что получить не удалось, отсутствует.
+    """
+    stock_assets = [a for a in assets if a in AVAILABLE_TICKERS]
+    crypto_assets = [a for a in assets if a in CRYPTO_IDS]
+    stock_prices, crypto_prices = await asyncio.gather(
+        get_many_yahoo_prices(session, stock_assets, use_cache=False),
+        get_many_crypto_prices(session, crypto_assets, use_cache=False),
+    )
+
+    prices: Dict[str, Tuple[float, str]] = {}
+    for asset in stock_assets:
+        pdata = stock_prices.get(asset)
+        if pdata:
+            prices[asset] = (pdata[0], pdata[1])
+    for asset, cdata in crypto_prices.items():
+        prices[asset] = (cdata["usd"], "USD")
+    return prices
+
+# ключи базы алертов в price_cache — один раз при импорте, а не f-строкой
+# на каждый актив каждого тика; база живёт в price_cache, чтобы переживать рестарт
+ALERT_KEYS: Dict[str, str] = {
+    **{ticker: f"alert_stock_{ticker}" for ticker in AVAILABLE_TICKERS},
+    **{symbol: f"alert_crypto_{symbol}" for symbol in CRYPTO_IDS},
+}
+
+def _alert_key(asset: str) -> str:
+    return ALERT_KEYS.get(asset) or f"alert_crypto_{asset}"
+
+async def prime_alert_baseline():
+    """
+    Стартовая база для алертов: один батч-запрос до первого тика джобы,
+    чтобы первый check_all_alerts уже сравнивал, а не просто запоминал цены.
+    Базу, пережившую рестарт в price_cache.json, не трогаем — иначе
+    проглотим движение, случившееся пока бот лежал.
+    """
+    try:
+        active_assets = get_all_active_assets()
+        if not active_assets:
+            return
+        session = await get_session()
+        prices = await fetch_all_prices(session, active_assets)
+    except Exception as e:
+        logger.warning("⚠️ alert baseline prime err: %s", e)
+        return
+
+    primed = 0
+    for asset, (price, _cur) in prices.items():
+        key = _alert_key(asset)
+        if price_cache.get_for_alert(key) is None:
+            price_cache.set_for_alert(key, price)
+            primed += 1
+    await price_cache.save_async()
+    logger.info("✅ alert baseline primed: %s/%s assets", primed, len(active_assets))
+
+def _scan_price_moves(old: np.ndarray, new: np.ndarray, th: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """ядро скана: (индексы, где |изменение %| >= порога; изменение в %). nan в old не срабатывает"""
+    pct = ((new - old) / old) * 100
+    return np.flatnonzero(np.abs(pct) >= th), pct
+
+if NUMBA_AVAILABLE:
+    # компилируется при первом тике, cache=True сохраняет машинный код между рестартами
+    _scan_price_moves = njit(cache=True)(_scan_price_moves)
+
+def _crypto_alert_line(asset: str, change_pct: float, price: float) -> str:
+    emoji = "🚀" if change_pct > 0 else "⚠️"
+    return (
+        f"{emoji} <b>{asset}</b>: {change_pct:+.2f}%\n"
+        f"Цена: ${price:,.2f}"
+    )
+
+def _collect_price_alerts(prices: Dict[str, Tuple[float, str]]) -> List[str]:
+    """
+    Резкие движения относительно прошлого тика; заодно обновляет базу в alert-кэше.
+    Один проход по dict собирает колонки (новая/прежняя цена, порог), дальше
+    процент изменения и сравнение с порогом — одним numpy-выражением;
+    строки алертов форматируем только для сработавших индексов.
+    """
+    n = len(prices)
+    if not n:
+        return []
+    assets = list(prices)
+    tickers = AVAILABLE_TICKERS
+    keys = ALERT_KEYS  # в prices только известные активы (фильтр в fetch_all_prices)
+    swap = price_cache.swap_for_alert
+    new = np.fromiter((price for price, _cur in prices.values()), dtype=float, count=n)
+    # swap пишет новую цену в базу и отдаёт прежнюю; нет базы -> nan (первое появление)
+    old = np.fromiter(
+        (swap(keys[asset], price) or np.nan for asset, (price, _cur) in prices.items()),
+        dtype=float,
+        count=n,
+    )
+    is_stock = np.fromiter((asset in tickers for asset in assets), dtype=bool, count=n)
+    th = np.where(is_stock, STOCK_THRESHOLD, CRYPTO_THRESHOLD)
+    hit, pct = _scan_price_moves(old, new, th)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        for asset, o, p, c in zip(assets, old, new, pct):
+            if np.isnan(o):
+                logger.debug("  %s: first seen %.2f", asset, p)
+            else:
+                logger.debug("  %s: %.2f->%.2f (%+.2f%%)", asset, o, p, c)
+
+    price_alerts: List[str] = []
+    for i in hit:
+        asset = assets[i]
+        price = prices[asset][0]
+        change_pct = float(pct[i])
+        if is_stock[i]:
+            emoji = "📈" if change_pct > 0 else "📉"
+            price_alerts.append(
+                f"{emoji} <b>{ASSET_NAMES_HTML[asset]}</b>: {change_pct:+.2f}%\n"
+                f"Цена: {price:.2f} {prices[asset][1]}"
+            )
+        else:
+            price_alerts.append(_crypto_alert_line(asset, change_pct, price))
+    return price_alerts
+
+def _collect_trade_alerts(prices: Dict[str, Tuple[float, str]]) -> Dict[int, List[str]]:
+    """
+    Цели по сделкам: один проход по всем сделкам против уже полученных цен,
+    без повторных запросов на каждого юзера. Помечает сработавшие как notified.
+    """
+    trade_alerts: Dict[int, List[str]] = {}
+    crypto_ids = CRYPTO_IDS
+    for uid, trades in user_trades.items():
+        for tr in trades:
+            if tr.get("notified"):
+                continue
+            asset = tr.get("symbol")
+            if asset not in crypto_ids:
+                continue
+            quote = prices.get(asset)
+            if quote is None:
+                continue
+            current_price = quote[0]
+            try:
+                entry_price = float(tr["entry_price"])
+                target = float(tr["target_profit_pct"])
+                amount = float(tr["amount"])
+            except Exception:
+                continue
+            if entry_price <= 0:
+                continue
+            try:
+                profit_pct = ((current_price - entry_price) / entry_price) * 100
+            except ZeroDivisionError:
+                continue
+
+            if profit_pct >= target:
+                value_now = amount * current_price
+                profit_usd = amount * (current_price - entry_price)
+
+                alert_text = (
+                    "🎯 <b>ЦЕЛЬ ДОСТИГНУТА!</b>\n\n"
+                    f"₿ {asset}\n"
+                    f"Кол-во: {amount:.4f}\n"
+                    f"Вход: ${entry_price:,.2f}\n"
+                    f"Сейчас: ${current_price:,.2f}\n\n"
+                    f"📈 Прибыль: <b>{profit_pct:.2f}%</b> "
+                    f"(${profit_usd:,.2f})\n"
+                    f"💵 Стоимость позиции: ${value_now:,.2f}\n\n"
+                    "💡 Рекомендация: 🟢 ПРОДАВАТЬ СЕЙЧАС"
+                )
+                trade_alerts.setdefault(uid, []).append(alert_text)
+                tr["notified"] = True
+                logger.info("  🚨 PROFIT ALERT uid=%s %s +%.2f%%", uid, asset, profit_pct)
+    return trade_alerts
+
+# исходящие алерты: джобы кладут (chat_id, текст) в очередь и сразу идут дальше,
+# а отправкой в Telegram занимается один долгоживущий sender — медленный
+# Bot API больше не держит следующий тик проверки цен
+ALERT_QUEUE: "asyncio.Queue[Tuple[str, str]]" = asyncio.Queue()
+PRICE_ALERTS_TITLE = "🔔 <b>Ценовые алерты!</b>\n\n"
+_alert_sender_task: Optional[asyncio.Task] = None
+
+async def alert_sender(bot):
+    while True:
+        chat_id, text = await ALERT_QUEUE.get()
+        try:
+            await bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML")
+        except Exception as e:
+            logger.warning("⚠️ Failed to send alert to %s: %s", chat_id, e)
+        finally:
+            ALERT_QUEUE.task_done()
+
+def start_alert_sender(application: Application):
+    global _alert_sender_task
+    if _alert_sender_task is None or _alert_sender_task.done():
+        _alert_sender_task = asyncio.create_task(alert_sender(application.bot))
+
+async def stop_alert_sender(timeout: float = 10.0):
+    """досылаем то, что уже в очереди (с таймаутом), и гасим sender"""
+    global _alert_sender_task
+    task = _alert_sender_task
+    if task is None:
+        return
+    if ALERT_QUEUE.qsize():
+        logger.info("⏳ Flushing %s queued alerts...", ALERT_QUEUE.qsize())
+        try:
+            await asyncio.wait_for(ALERT_QUEUE.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("  ⚠️ %s alerts dropped on shutdown", ALERT_QUEUE.qsize())
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    _alert_sender_task = None
+
 async def check_all_alerts(context: ContextTypes.DEFAULT_TYPE):
     """
     Джоба каждые N минут:
@@ -1150,216 +1874,230 @@ async def check_all_alerts(context: ContextTypes.DEFAULT_TYPE):
     """
     if not context.application:
         return
-    bot = context.application.bot
 
-    print("🔔 Running alerts check...")
+    logger.info("🔔 Running alerts check...")
 
     try:
         active_assets = get_all_active_assets()
     except Exception as e:
-        print(f"⚠️ active_assets err: {e}")
+        logger.warning("⚠️ active_assets err: %s", e)
         return
 
     if not active_assets:
-        print("ℹ️  No active assets, skip alerts")
+        logger.info("ℹ️  No active assets, skip alerts")
         return
 
-    print(f"📊 {len(active_assets)} assets to check")
-
-    price_alerts: List[str] = []
-    trade_alerts: Dict[int, List[str]] = {}
+    logger.info("📊 %s assets to check", len(active_assets))
 
-    async with aiohttp.ClientSession() as session:
-        for asset, user_ids in active_assets.items():
-            # акции/ETF
-            if asset in AVAILABLE_TICKERS:
-                pdata = await get_yahoo_price(session, asset)
-                if pdata:
-                    price, currency, _chg = pdata
-                    cache_key = f"alert_stock_{asset}"
-                    old_price = price_cache.get_for_alert(cache_key)
-
-                    if old_price and old_price > 0:
-                        try:
-                            change_pct = ((price - old_price) / old_price) * 100
-                        except ZeroDivisionError:
-                            change_pct = 0.0
-
-                        print(f"  {asset}: {old_price:.2f}->{price:.2f} ({change_pct:+.2f}%)")
-
-                        if abs(change_pct) >= THRESHOLDS["stocks"]:
-                            name = AVAILABLE_TICKERS[asset]["name"]
-                            emoji = "📈" if change_pct > 0 else "📉"
-                            price_alerts.append(
-                                f"{emoji} <b>{name}</b>: {change_pct:+.2f}%\n"
-                                f"Цена: {price:.2f} {currency}"
-                            )
-                    else:
-                        print(f"  {asset}: first seen {price:.2f}")
-
-                    price_cache.set_for_alert(cache_key, price)
-
-            # крипта
-            elif asset in CRYPTO_IDS:
-                cdata = await get_crypto_price(session, asset, use_cache=False)
-                if not cdata:
-                    await asyncio.sleep(0.2)
-                    continue
-                current_price = cdata["usd"]
-                cache_key = f"alert_crypto_{asset}"
-                old_price = price_cache.get_for_alert(cache_key)
+    session = await get_session()
+    prices = await fetch_all_prices(session, active_assets)
 
-                if old_price and old_price > 0:
-                    try:
-                        change_pct = ((current_price - old_price) / old_price) * 100
-                    except ZeroDivisionError:
-                        change_pct = 0.0
-
-                    print(f"  {asset}: {old_price:.2f}->{current_price:.2f} ({change_pct:+.2f}%)")
-
-                    if abs(change_pct) >= THRESHOLDS["crypto"]:
-                        emoji = "🚀" if change_pct > 0 else "⚠️"
-                        price_alerts.append(
-                            f"{emoji} <b>{asset}</b>: {change_pct:+.2f}%\n"
-                            f"Цена: ${current_price:,.2f}"
-                        )
-                else:
-                    print(f"  {asset}: first crypto price {current_price:.2f}")
-
-                price_cache.set_for_alert(cache_key, current_price)
-
-                # сделки юзеров (триггер цели)
-                for uid in user_ids:
-                    trades = get_user_trades(uid)
-                    for tr in trades:
-                        if tr.get("symbol") != asset:
-                            continue
-                        if tr.get("notified"):
-                            continue
-                        try:
-                            entry_price = float(tr["entry_price"])
-                            target = float(tr["target_profit_pct"])
-                            amount = float(tr["amount"])
-                        except Exception:
-                            continue
-                        if entry_price <= 0:
-                            continue
-                        try:
-                            profit_pct = ((current_price - entry_price) / entry_price) * 100
-                        except ZeroDivisionError:
-                            continue
-
-                        if profit_pct >= target:
-                            value_now = amount * current_price
-                            profit_usd = amount * (current_price - entry_price)
-
-                            alert_text = (
-                                "🎯 <b>ЦЕЛЬ ДОСТИГНУТА!</b>\n\n"
-                                f"₿ {asset}\n"
-                                f"Кол-во: {amount:.4f}\n"
-                                f"Вход: ${entry_price:,.2f}\n"
-                                f"Сейчас: ${current_price:,.2f}\n\n"
-                                f"📈 Прибыль: <b>{profit_pct:.2f}%</b> "
-                                f"(${profit_usd:,.2f})\n"
-                                f"💵 Стоимость позиции: ${value_now:,.2f}\n\n"
-                                "💡 Рекомендация: 🟢 ПРОДАВАТЬ СЕЙЧАС"
-                            )
-                            trade_alerts.setdefault(uid, []).append(alert_text)
-                            tr["notified"] = True
-                            print(f"  🚨 PROFIT ALERT uid={uid} {asset} +{profit_pct:.2f}%")
-
-            await asyncio.sleep(0.15)
+    price_alerts = _collect_price_alerts(prices)
+    trade_alerts = _collect_trade_alerts(prices)
 
     # update local trades after target triggers
     if trade_alerts:
-        save_trades_local()
+        await save_trades_local_async()
 
-    price_cache.save()
+    await price_cache.save_async()
 
     # резкие движения -> общий канал
     if price_alerts and CHAT_ID:
-        msg = "🔔 <b>Ценовые алерты!</b>\n\n" + "\n\n".join(price_alerts)
-        try:
-            await bot.send_message(chat_id=CHAT_ID, text=msg, parse_mode="HTML")
-            print(f"📤 Sent {len(price_alerts)} price alerts to {CHAT_ID}")
-        except Exception as e:
-            print(f"⚠️ Failed to send price alerts: {e}")
+        msg = PRICE_ALERTS_TITLE + "\n\n".join(price_alerts)
+        ALERT_QUEUE.put_nowait((CHAT_ID, msg))
+        logger.info("📤 Queued %s price alerts for %s", len(price_alerts), CHAT_ID)
 
     # таргеты -> личка
-    sent_trade_alerts = 0
+    queued_trade_alerts = 0
     for uid, alerts in trade_alerts.items():
         for text in alerts:
-            try:
-                await bot.send_message(chat_id=str(uid), text=text, parse_mode="HTML")
-                sent_trade_alerts += 1
-            except Exception as e:
-                print(f"⚠️ Failed to DM trade alert to {uid}: {e}")
-    if sent_trade_alerts:
-        print(f"📤 Sent {sent_trade_alerts} trade alerts to {len(trade_alerts)} users")
+            ALERT_QUEUE.put_nowait((str(uid), text))
+            queued_trade_alerts += 1
+    if queued_trade_alerts:
+        logger.info("📤 Queued %s trade alerts for %s users", queued_trade_alerts, len(trade_alerts))
 
     cache_stats = price_cache.get_stats()
-    print(f"📊 Cache stats: {cache_stats}")
+    logger.info("📊 Cache stats: %s", cache_stats)
     price_cache.reset_stats()
-    print("✅ Alerts check done\n")
+    logger.info("✅ Alerts check done\n")
 
 # =========================================================
-# ================== FINNHUB CALENDAR =====================
+# ================ BINANCE PRICE STREAM ===================
 # =========================================================
 
-async def get_economic_calendar(session: aiohttp.ClientSession, days: int = 7) -> List[Dict[str, Any]]:
+# push-цены крипты: один websocket на все монеты, только наши пары (miniTicker
+# шлёт обновление ~раз в секунду). Резкое движение ловим сразу, а не на
+# следующем тике джобы; база — та же alert_crypto_* в price_cache
+BINANCE_PAIRS: Dict[str, str] = {info["binance"]: sym for sym, info in CRYPTO_IDS.items()}
+BINANCE_STREAM_URL = "wss://stream.binance.com:9443/stream?streams=" + "/".join(
+    f"{pair.lower()}@miniTicker" for pair in BINANCE_PAIRS
+)
+BINANCE_STREAM_MAX_BACKOFF = 60
+_binance_stream_task: Optional[asyncio.Task] = None
+
+def _check_stream_ticker(row: Dict[str, Any]) -> Optional[str]:
     """
-    Важные макро события (ФРС, NFP, CPI)
-    Finnhub endpoint: /calendar/economic
+    Одна цена из стрима против базы алертов. Сравниваем только с живой базой
+    (её обновляет джоба для тех, кто реально держит монету), при срабатывании
+    база переезжает на текущую цену — повторно тот же скачок не придёт.
     """
-    if not FINNHUB_API_KEY:
-        return []
-
-    today = datetime.utcnow().date()
-    until = today + timedelta(days=days)
-
-    url = "https://finnhub.io/api/v1/calendar/economic"
-    params = {
+    asset = BINANCE_PAIRS.get(row.get("s"))
+    if asset is None:
+        return None
+    key = ALERT_KEYS[asset]
+    old = price_cache.get_for_alert(key, max_age=2 * ALERT_INTERVAL)
+    if old is None:
+        return None
+    price = _safe_float(row.get("c"))
+    if price is None or price <= 0:
+        return None
+    change_pct = (price - old) / old * 100
+    if abs(change_pct) < CRYPTO_THRESHOLD:
+        return None
+    price_cache.set_for_alert(key, price)
+    logger.info("  ⚡ stream alert %s %+.2f%%", asset, change_pct)
+    return _crypto_alert_line(asset, change_pct, price)
+
+async def binance_price_stream():
+    """держим websocket открытым; обрыв (Binance рвёт раз в сутки) -> переподключение с backoff"""
+    delay = 1
+    while True:
+        try:
+            session = await get_session()
+            async with session.ws_connect(BINANCE_STREAM_URL, heartbeat=30) as ws:
+                logger.info("✅ Binance price stream connected")
+                delay = 1
+                async for msg in ws:
+                    if msg.type != aiohttp.WSMsgType.TEXT:
+                        if msg.type == aiohttp.WSMsgType.ERROR:
+                            break
+                        continue
+                    line = _check_stream_ticker(orjson.loads(msg.data).get("data") or {})
+                    if line and CHAT_ID:
+                        ALERT_QUEUE.put_nowait((CHAT_ID, PRICE_ALERTS_TITLE + line))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("⚠️ Binance stream err: %s", e)
+        logger.info("🔁 Binance stream reconnect in %ss", delay)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, BINANCE_STREAM_MAX_BACKOFF)
+
+def start_binance_stream():
+    global _binance_stream_task
+    if _binance_stream_task is None or _binance_stream_task.done():
+        _binance_stream_task = asyncio.create_task(binance_price_stream())
+
+async def stop_binance_stream():
+    global _binance_stream_task
+    task = _binance_stream_task
+    if task is None:
+        return
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    _binance_stream_task = None
+
+# =========================================================
+# ================== FINNHUB CALENDAR =====================
+# =========================================================
+
+class EconEvent(NamedTuple):
+    date: str
+    title: str
+    impact: str
+    country: str
+
+class EarningsEvent(NamedTuple):
+    date: str
+    symbol: str
+    eps_estimate: Any
+    revenue_estimate: Any
+
+# окно календаря сдвигается раз в сутки, так что ответ Finnhub живёт до смены даты:
+# {(вид, дней вперёд): (дата, события)}; неудачные ответы не кэшируем
+_calendar_cache: Dict[Tuple[str, int], Tuple[date, List[Any]]] = {}
+
+def _calendar_params(today: date, days: int) -> Dict[str, str]:
+    """from/to/token для Finnhub: окно [today, today+days], общее для обоих календарей"""
+    return {
         "from": today.isoformat(),
-        "to": until.isoformat(),
-        "token": FINNHUB_API_KEY
+        "to": (today + timedelta(days=days)).isoformat(),
+        "token": FINNHUB_API_KEY,
     }
+
+async def _calendar_cached(
+    kind: str,
+    today: date,
+    days: int,
+    fetch: Callable[[], Awaitable[Optional[List[Any]]]],
+) -> List[Any]:
+    hit = _calendar_cache.get((kind, days))
+    if hit and hit[0] == today:
+        return hit[1]
+
+    async def _fetch():
+        events = await fetch()
+        if events is not None:
+            _calendar_cache[(kind, days)] = (today, events)
+        return events or []
+
+    return await _single_flight(f"calendar_{kind}_{days}_{today}", _fetch)
+
+async def get_economic_calendar(session: aiohttp.ClientSession, days: int = 7) -> List[EconEvent]:
+    """
+    Важные макро события (ФРС, NFP, CPI)
+    Finnhub endpoint: /calendar/economic
+    """
+    if not FINNHUB_API_KEY:
+        return []
+
+    today = datetime.utcnow().date()
+    return await _calendar_cached(
+        "econ", today, days, lambda: _fetch_economic_calendar(session, today, days)
+    )
+
+async def _fetch_economic_calendar(
+    session: aiohttp.ClientSession, today: date, days: int
+) -> Optional[List[EconEvent]]:
+    url = "https://finnhub.io/api/v1/calendar/economic"
+    params = _calendar_params(today, days)
     try:
         async with session.get(url, params=params, timeout=TIMEOUT) as resp:
             if resp.status != 200:
-                print(f"⚠️ economic cal HTTP {resp.status}")
-                return []
-            data = await resp.json()
+                logger.warning("⚠️ economic cal HTTP %s", resp.status)
+                return None
+            data = await resp.json(loads=orjson.loads)
     except Exception as e:
-        print(f"⚠️ econ cal err: {e}")
-        return []
+        logger.warning("⚠️ econ cal err: %s", e)
+        return None
 
     out = []
-    events = data.get("economicCalendar", []) or data.get("economicCalendar", [])
+    events = data.get("economicCalendar") or []
     # finnhub иногда возвращает "economicCalendar", иногда "data", поэтому:
     if not events and "data" in data:
         events = data["data"]
 
-    high_keywords = ["FOMC", "Nonfarm", "Payrolls", "Fed", "CPI", "GDP", "Unemployment"]
     for ev in events:
         # пример структуры может отличаться, но берём date/time/impact/actual/estimate/event
-        date_str = ev.get("date")
         title = ev.get("event") or ev.get("country") or "?"
-        impact = ev.get("impact") or ev.get("importance") or ""
-        country = ev.get("country") or ev.get("region") or ""
-        # фильтр: только high impact или ключевые слова
-        txt = f"{title} {impact}"
-        if any(k.lower() in txt.lower() for k in high_keywords) or "High" in impact:
-            out.append({
-                "date": date_str,
-                "title": title,
-                "impact": impact,
-                "country": country,
-            })
+        impact = str(ev.get("impact") or ev.get("importance") or "")
+        # фильтр: только high impact или ключевые слова (один lower() на событие)
+        txt = f"{title} {impact}".lower()
+        if "High" in impact or any(k in txt for k in ECON_HIGH_KEYWORDS):
+            out.append(EconEvent(
+                ev.get("date") or "?",
+                title,
+                impact,
+                ev.get("country") or ev.get("region") or "",
+            ))
     return out
 
 TOP_EARNINGS = ["AAPL", "MSFT", "GOOGL", "AMZN", "TSLA", "NVDA", "META"]
+# фильтры календарей: ключевые слова уже в lower, интересные тикеры одним set
+ECON_HIGH_KEYWORDS = tuple(k.lower() for k in ("FOMC", "Nonfarm", "Payrolls", "Fed", "CPI", "GDP", "Unemployment"))
+EARNINGS_WATCH = frozenset(TOP_EARNINGS) | frozenset(AVAILABLE_TICKERS)
 
-async def get_earnings_calendar(session: aiohttp.ClientSession, days: int = 7) -> List[Dict[str, Any]]:
+async def get_earnings_calendar(session: aiohttp.ClientSession, days: int = 7) -> List[EarningsEvent]:
     """
     Отчётность компаний (крупные тикеры + то, что может быть в портфеле)
     Finnhub endpoint: /calendar/earnings
@@ -1367,124 +2105,265 @@ async def get_earnings_calendar(session: aiohttp.ClientSession, days: int = 7) -
     if not FINNHUB_API_KEY:
         return []
     today = datetime.utcnow().date()
-    until = today + timedelta(days=days)
+    return await _calendar_cached(
+        "earnings", today, days, lambda: _fetch_earnings_calendar(session, today, days)
+    )
 
+async def _fetch_earnings_calendar(
+    session: aiohttp.ClientSession, today: date, days: int
+) -> Optional[List[EarningsEvent]]:
     url = "https://finnhub.io/api/v1/calendar/earnings"
-    params = {
-        "from": today.isoformat(),
-        "to": until.isoformat(),
-        "token": FINNHUB_API_KEY
-    }
+    params = _calendar_params(today, days)
     try:
         async with session.get(url, params=params, timeout=TIMEOUT) as resp:
             if resp.status != 200:
-                print(f"⚠️ earnings cal HTTP {resp.status}")
-                return []
-            data = await resp.json()
+                logger.warning("⚠️ earnings cal HTTP %s", resp.status)
+                return None
+            data = await resp.json(loads=orjson.loads)
     except Exception as e:
-        print(f"⚠️ earnings cal err: {e}")
-        return []
+        logger.warning("⚠️ earnings cal err: %s", e)
+        return None
 
-    events = data.get("earningsCalendar", []) or data.get("earningsCalendar", [])
-    out = []
-    for ev in events:
-        sym = ev.get("symbol")
-        if not sym:
-            continue
-        # фильтр по интересу: большие бренды/тех или топ из списка
-        if sym.upper() in TOP_EARNINGS or sym.upper() in AVAILABLE_TICKERS:
-            out.append({
-                "date": ev.get("date"),
-                "symbol": sym.upper(),
-                "eps_estimate": ev.get("epsEstimate"),
-                "revenue_estimate": ev.get("revenueEstimate"),
-            })
+    # фильтр по интересу: большие бренды/тех или топ из списка — один проход
+    return [
+        EarningsEvent(ev.get("date") or "?", sym, ev.get("epsEstimate"), ev.get("revenueEstimate"))
+        for ev in data.get("earningsCalendar") or []
+        if (sym := (ev.get("symbol") or "").upper()) in EARNINGS_WATCH
+    ]
+
+# одна ячейка: последние отрендеренные календари и списки, из которых они сделаны.
+# Календари кэшируются по дате и приходят одними и теми же объектами весь день,
+# поэтому проверка "is" = "тот же день, те же данные"
+_calendar_render_memo: Dict[str, Any] = {"src": None, "out": None}
+
+def _render_calendar_sections(
+    econ_events: List[EconEvent],
+    earn_events: List[EarningsEvent],
+) -> Tuple[str, List[Tuple[str, str]]]:
+    """
+    Общая для всех юзеров часть /events: готовый блок макро
+    и строки отчётов (symbol, текст без пометки о портфеле).
+    """
+    src = _calendar_render_memo["src"]
+    if src is not None and src[0] is econ_events and src[1] is earn_events:
+        return _calendar_render_memo["out"]
+
+    # Макро
+    if econ_events:
+        econ_text = "\n".join(
+            f"📅 {_h(ev.date)} | {_h(ev.country)}\n"
+            f"   {_h(ev.title)}\n"
+            f"   Влияние: {_h(_impact_cell(ev.impact))}"
+            for ev in econ_events[:6]
+        )
+    else:
+        econ_text = "Нет крупных событий (или нет FINNHUB_API_KEY)"
+    macro_block = f"{EVENTS_MACRO_HEAD}\n{econ_text}\n"
+
+    earn_rows = [
+        (
+            ev.symbol,
+            f"📅 {_h(ev.date)} | {_h(ev.symbol)}\n"
+            f"   EPS est: {_h(ev.eps_estimate)}, Rev est: {_h(ev.revenue_estimate)}\n"
+            "   ",
+        )
+        for ev in earn_events[:6]
+    ]
+
+    out = (macro_block, earn_rows)
+    _calendar_render_memo["src"] = (econ_events, earn_events)
+    _calendar_render_memo["out"] = out
     return out
 
 def format_events_block(
-    econ_events: List[Dict[str, Any]],
-    earn_events: List[Dict[str, Any]],
+    econ_events: List[EconEvent],
+    earn_events: List[EarningsEvent],
     pf: Dict[str, float],
     fg_val: Optional[int],
     now_riga_str: str,
 ) -> str:
-    lines: List[str] = []
-
-    lines.append("📰 <b>СОБЫТИЯ НЕДЕЛИ</b>")
-    lines.append("━━━━━━━━━━━━━━━━━━━━━━━━━━━")
-    lines.append(f"⏰ {now_riga_str}")
-    lines.append("")
+    macro_block, earn_rows = _render_calendar_sections(econ_events, earn_events)
 
-    # Макро
-    lines.append("📊 <b>ФОНДОВЫЙ РЫНОК / МАКРО</b>")
-    lines.append("━━━━━━━━━━━━━━━━━━━━━━━━━━━")
-    if econ_events:
-        for ev in econ_events[:6]:
-            date_s = ev.get("date", "?")
-            title = ev.get("title", "?")
-            country = ev.get("country", "")
-            impact = ev.get("impact", "")
-            lines.append(
-                f"📅 {date_s} | {country}\n"
-                f"   {title}\n"
-                f"   Влияние: {impact or '—'}"
-            )
-    else:
-        lines.append("Нет крупных событий (или нет FINNHUB_API_KEY)")
-    lines.append("")
-
-    # Earnings
-    lines.append("🏢 <b>ОТЧЁТНОСТЬ КОМПАНИЙ</b>")
-    lines.append("━━━━━━━━━━━━━━━━━━━━━━━━━━━")
-    if earn_events:
-        for ev in earn_events[:6]:
-            sym = ev.get("symbol")
-            owned_mark = "✅ У вас в портфеле" if sym in pf else "—"
-            lines.append(
-                f"📅 {ev.get('date','?')} | {sym}\n"
-                f"   EPS est: {ev.get('eps_estimate','?')}, Rev est: {ev.get('revenue_estimate','?')}\n"
-                f"   {owned_mark}"
-            )
+    # Earnings: текст общий, пометка о портфеле — персональная
+    if earn_rows:
+        earn_lines = [row + ("✅ У вас в портфеле" if sym in pf else "—") for sym, row in earn_rows]
     else:
-        lines.append("Нет значимых отчётов / ключевые тикеры не попали в окно")
-    lines.append("")
+        earn_lines = ["Нет значимых отчётов / ключевые тикеры не попали в окно"]
 
     # Крипта
-    lines.append("₿ <b>КРИПТОВАЛЮТЫ</b>")
-    lines.append("━━━━━━━━━━━━━━━━━━━━━━━━━━━")
     if fg_val is not None:
-        if fg_val < 25:
-            mood = "😱 Экстремальный страх → часто хорошая точка входа для долгосрока"
-        elif fg_val < 45:
-            mood = "😰 Страх → рынок нервничает, можно подбирать понемногу"
-        elif fg_val < 75:
-            mood = "😃 Жадность → рынок оптимистичен"
-        else:
-            mood = "🤑 Экстремальная жадность → потенциал перегрева"
-        lines.append(
-            f"Fear & Greed Index: {fg_val}/100\n"
-            f"{mood}"
-        )
+        mood = EVENTS_MOOD_LABELS[bisect_right(EVENTS_MOOD_BOUNDS, fg_val)]
+        crypto_text = f"Fear & Greed Index: {fg_val}/100\n{mood}"
     else:
-        lines.append("Нет данных по настроению рынка (fear & greed)")
+        crypto_text = "Нет данных по настроению рынка (fear & greed)"
 
     # персональный контекст
-    lines.append("")
-    lines.append("🧠 <b>ВАЖНО ДЛЯ ВАС</b>")
-    lines.append("━━━━━━━━━━━━━━━━━━━━━━━━━━━")
-    if pf:
-        for ticker, qty in pf.items():
-            if qty and qty > 0:
-                lines.append(f"• {ticker}: активен у вас")
-    else:
-        lines.append("У вас пустой портфель")
-    lines.append("")
-    return "\n".join(lines)
+    # нет портфеля и портфель из одних нулей — одно и то же
+    personal_lines = [
+        f"• {_h(ticker)}: активен у вас" for ticker, qty in pf.items() if qty and qty > 0
+    ] or ["У вас пустой портфель"]
+
+    return "\n".join((
+        EVENTS_TITLE,
+        f"⏰ {now_riga_str}",
+        "",
+        macro_block,  # готовый блок, рендерится раз на обновление календаря
+        EVENTS_EARNINGS_HEAD,
+        *earn_lines,
+        "",
+        EVENTS_CRYPTO_HEAD,
+        crypto_text,
+        "",
+        EVENTS_PERSONAL_HEAD,
+        *personal_lines,
+        "",
+    ))
 
 # =========================================================
 # ======================= UI HELPERS ======================
 # =========================================================
 
+SEP = "━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+
+# каркас таблиц /all_prices: рамки статичны, меняются только строки
+STOCK_TABLE_HEAD = (
+    "<pre>\n"
+    "┌──────────────────┬────────────┬─────────┐\n"
+    "│ Актив            │ Цена       │ 24h     │\n"
+    "├──────────────────┼────────────┼─────────┤"
+)
+STOCK_TABLE_FOOT = "└──────────────────┴────────────┴─────────┘\n</pre>\n"
+STOCK_ROW_FMT = "│ {name:<16.16} │ {price:<10} │ {chg:>7} │"
+
+CRYPTO_TABLE_HEAD = (
+    "<pre>\n"
+    "┌────────┬──────────────┬─────────┬──────────┐\n"
+    "│ Монета │ Цена         │ 24h     │ Источник │\n"
+    "├────────┼──────────────┼─────────┼──────────┤"
+)
+CRYPTO_TABLE_FOOT = "└────────┴──────────────┴─────────┴──────────┘\n</pre>"
+CRYPTO_ROW_FMT = "│ {sym:<6} │ {price:<12} │ {chg:>7} │ {source:<8.8} │"
+
+# заголовки секций /events — статичные, собираем один раз
+EVENTS_TITLE = f"📰 <b>СОБЫТИЯ НЕДЕЛИ</b>\n{SEP}"
+EVENTS_MACRO_HEAD = f"📊 <b>ФОНДОВЫЙ РЫНОК / МАКРО</b>\n{SEP}"
+EVENTS_EARNINGS_HEAD = f"🏢 <b>ОТЧЁТНОСТЬ КОМПАНИЙ</b>\n{SEP}"
+EVENTS_CRYPTO_HEAD = f"₿ <b>КРИПТОВАЛЮТЫ</b>\n{SEP}"
+EVENTS_PERSONAL_HEAD = f"🧠 <b>ВАЖНО ДЛЯ ВАС</b>\n{SEP}"
+
+# Finnhub отдаёт impact из маленького набора значений — подписи готовим заранее
+IMPACT_LABELS = {
+    "low": "низкое",
+    "medium": "среднее",
+    "high": "🔥 высокое",
+}
+
+def _impact_cell(impact: Any) -> str:
+    if not impact:
+        return "—"
+    impact = str(impact)
+    return IMPACT_LABELS.get(impact.lower(), impact)
+
+# шапка /events с точностью до минуты: strftime не чаще раза в минуту,
+# остальные вызовы в ту же минуту берут готовую строку
+_minute_stamp_cache: List[Any] = [-1, ""]
+
+def _riga_minute_stamp() -> str:
+    bucket = int(time.time()) // 60
+    if _minute_stamp_cache[0] != bucket:
+        _minute_stamp_cache[:] = [bucket, datetime.now(RIGA_TZ).strftime("%d.%m.%Y %H:%M (Рига)")]
+    return _minute_stamp_cache[1]
+
+TG_MESSAGE_LIMIT = 4096
+
+def _fit_blocks(blocks: Iterable[str], limit: int) -> Iterable[str]:
+    for block in blocks:
+        if len(block) <= limit:
+            yield block
+            continue
+        logger.warning("⚠️ message block of %s chars > %s, splitting by lines", len(block), limit)
+        lines = [
+            line[i:i + limit]
+            for line in block.split("\n")
+            for i in range(0, len(line) or 1, limit)
+        ]
+        yield from _pack_messages(lines, "\n", limit)
+
+def _pack_messages(blocks: Iterable[str], sep: str = "\n", limit: int = TG_MESSAGE_LIMIT) -> List[str]:
+    """
+    Склеивает готовые блоки в как можно меньше сообщений не длиннее limit.
+    Блок целиком попадает в одно сообщение, поэтому HTML-теги внутри него
+    остаются парными. Блок длиннее limit Telegram не примет вовсе — такой
+    режем по строкам (теги у нас не переносятся через строку).
+    """
+    out: List[str] = []
+    cur: List[str] = []
+    size = 0
+    for block in _fit_blocks(blocks, limit):
+        add = len(block) + (len(sep) if cur else 0)
+        if cur and size + add > limit:
+            out.append(sep.join(cur))
+            cur, size, add = [], 0, len(block)
+        cur.append(block)
+        size += add
+    if cur:
+        out.append(sep.join(cur))
+    return out
+
+def _h(value: Any) -> str:
+    """экранирование внешних строк для parse_mode=HTML (<, >, & ломают разбор у Telegram)"""
+    return html.escape(str(value), quote=False)
+
+def _chg_cell(chg: Optional[float]) -> str:
+    if chg is None:
+        return "N/A"
+    if chg == 0:
+        return "0.0%"
+    return f"{'↗' if chg > 0 else '↘'}{abs(chg):.1f}%"
+
+# компактный вариант: без рамок и моноширинного блока, примерно втрое меньше байт
+STOCK_PLAIN_FMT = "• <b>{name}</b>: {price} · {chg}"
+CRYPTO_PLAIN_FMT = "• <b>{sym}</b>: {price} · {chg} · {source}"
+
+# (шапка, формат строки, подвал) для акций и крипты; шапка/подвал — кортежи под *splat
+ALL_PRICES_LAYOUTS = {
+    "table": (
+        ((STOCK_TABLE_HEAD,), STOCK_ROW_FMT, (STOCK_TABLE_FOOT,)),
+        ((CRYPTO_TABLE_HEAD,), CRYPTO_ROW_FMT, (CRYPTO_TABLE_FOOT,)),
+    ),
+    "plain": (
+        ((), STOCK_PLAIN_FMT, ("",)),
+        ((), CRYPTO_PLAIN_FMT, ()),
+    ),
+}
+
+def _stock_row(
+    name: str,
+    pdata: Optional[Tuple[float, str, Optional[float]]],
+    fmt: str = STOCK_ROW_FMT,
+) -> str:
+    # в <pre>-таблице экранируем готовую строку: ширины колонок считаются
+    # по видимым символам, а "&amp;" после обрезки/паддинга сбил бы выравнивание
+    pre = fmt is STOCK_ROW_FMT
+    name = name if pre else _h(name)
+    if not pdata:
+        row = fmt.format(name=name, price="н/д", chg="N/A")
+    else:
+        price, cur, chg = pdata
+        row = fmt.format(name=name, price=f"{price:.2f} {cur}", chg=_chg_cell(chg))
+    return _h(row) if pre else row
+
+def _crypto_row(symbol: str, cdata: Optional[Dict[str, Any]], fmt: str = CRYPTO_ROW_FMT) -> str:
+    if not cdata:
+        return fmt.format(sym=symbol, price="н/д", chg="N/A", source="—")
+    # символы и источники — наши константы, спецсимволов в них нет
+    return fmt.format(
+        sym=symbol,
+        price=f"${cdata['usd']:,.2f}",
+        chg=_chg_cell(cdata.get("change_24h")),
+        source=cdata.get("source", "—"),
+    )
+
 def _bar(percent: float, length: int = 10, filled_char="🟩", empty_char="⬜") -> str:
     # percent e.g. 74.5 -> fill round(percent/100*len)
     if percent < 0:
@@ -1571,16 +2450,7 @@ async def get_ai_advice(
     # Fear & Greed
     fg_val = market_data.get("fear_greed", {}).get("value", "N/A")
     if fg_val != "N/A":
-        if fg_val < 25:
-            fg_mood = "Экстремальный страх 😱"
-        elif fg_val < 45:
-            fg_mood = "Страх 😰"
-        elif fg_val < 55:
-            fg_mood = "Нейтрально 😐"
-        elif fg_val < 75:
-            fg_mood = "Жадность 😃"
-        else:
-            fg_mood = "Экстремальная жадность 🤑"
+        fg_mood = FEAR_GREED_LABELS[bisect_right(FEAR_GREED_BOUNDS, fg_val)]
     else:
         fg_mood = "Нет данных"
     
@@ -1626,8 +2496,7 @@ Fear & Greed: {fg_val}/100 ({fg_mood})
         return response.choices[0].message.content
         
     except Exception as e:
-        print(f"❌ AI advisor error: {e}")
-        traceback.print_exc()
+        logger.exception("❌ AI advisor error")
         return f"⚠️ Ошибка: {str(e)}"
 
 
@@ -1650,63 +2519,159 @@ async def cmd_ask_ai(update: Update, context: ContextTypes.DEFAULT_TYPE):
     question = " ".join(context.args)
     
     msg = await update.message.reply_text(
-        f"🤖 Анализирую...\n<i>\"{question}\"</i>",
+        f"🤖 Анализирую...\n<i>\"{_h(question)}\"</i>",
         parse_mode="HTML"
     )
     
-    portfolio = get_user_portfolio(uid)
+    portfolio = peek_user_portfolio(uid)
     market_data = {}
     
     try:
-        async with aiohttp.ClientSession() as session:
-            fg_val = await get_fear_greed_index(session)
+        session = await get_session()
+        fg_val, crypto_prices, ta_results = await asyncio.gather(
+            get_fear_greed_index(session),
+            get_many_crypto_prices(session, SIGNAL_SYMBOLS, use_cache=False),
+            _gather_quiet(*(calculate_technical_indicators(session, s) for s in SIGNAL_SYMBOLS)),
+        )
+        for symbol, ta_data in zip(SIGNAL_SYMBOLS, ta_results):
+            cdata = crypto_prices.get(symbol)
             
-            for symbol in ["BTC", "ETH", "SOL", "AVAX"]:
-                cdata = await get_crypto_price(session, symbol, use_cache=False)
-                ta_data = await calculate_technical_indicators(session, symbol)
-                
-                if cdata and ta_data:
-                    market_data[symbol] = {
-                        "price": cdata["usd"],
-                        "change_24h": cdata.get("change_24h"),
-                        "rsi": ta_data.get("rsi"),
-                        "trend": ta_data.get("trend"),
-                        "macd_bullish": ta_data.get("macd_bullish"),
-                    }
-                
-                await asyncio.sleep(0.2)
+            if cdata and ta_data:
+                market_data[symbol] = {
+                    "price": cdata["usd"],
+                    "change_24h": cdata.get("change_24h"),
+                    "rsi": ta_data.get("rsi"),
+                    "trend": ta_data.get("trend"),
+                    "macd_bullish": ta_data.get("macd_bullish"),
+                }
             
-            market_data["fear_greed"] = {"value": fg_val}
+        market_data["fear_greed"] = {"value": fg_val}
         
         advice = await get_ai_advice(uid, question, portfolio, market_data)
         
-        full_msg = f"🤖 <b>AI-Советник</b>\n\n{advice}\n\n━━━━━━━━━━━━━━━━━━━━━━━━━━━\n<i>⚠️ Не финсовет. DYOR!</i>"
+        # ответ модели — произвольный текст ("RSI < 30" и т.п.): экранируем,
+        # причём уже после нарезки, чтобы не разрезать "&lt;" пополам
+        full_msg = f"🤖 <b>AI-Советник</b>\n\n{_h(advice)}\n\n━━━━━━━━━━━━━━━━━━━━━━━━━━━\n<i>⚠️ Не финсовет. DYOR!</i>"
         
         if len(full_msg) > 4000:
-            await msg.edit_text(f"🤖 <b>AI-Советник</b>\n\n{advice[:3500]}", parse_mode="HTML")
-            await update.message.reply_text(advice[3500:] + "\n\n━━━━━━━━━━━━━━━━━━━━━━━━━━━\n<i>⚠️ Не финсовет. DYOR!</i>", parse_mode="HTML")
+            await msg.edit_text(f"🤖 <b>AI-Советник</b>\n\n{_h(advice[:3500])}", parse_mode="HTML")
+            await update.message.reply_text(_h(advice[3500:]) + "\n\n━━━━━━━━━━━━━━━━━━━━━━━━━━━\n<i>⚠️ Не финсовет. DYOR!</i>", parse_mode="HTML")
         else:
             await msg.edit_text(full_msg, parse_mode="HTML")
         
     except Exception as e:
-        print(f"❌ ask_ai error: {e}")
-        traceback.print_exc()
-        await msg.edit_text(f"⚠️ Ошибка AI: {str(e)}", parse_mode="HTML")
+        logger.exception("❌ ask_ai error")
+        await msg.edit_text(f"⚠️ Ошибка AI: {_h(e)}", parse_mode="HTML")
 
 
 # =========================================================
 # ======================== HANDLERS =======================
 # =========================================================
 
-def get_main_menu():
-    keyboard = [
+# клавиатуры из статичных справочников: объекты PTB неизменяемые,
+# поэтому собираем один раз при импорте и отдаём один и тот же экземпляр
+MAIN_MENU_KB = ReplyKeyboardMarkup(
+    [
         [KeyboardButton("💼 Мой портфель"), KeyboardButton("💹 Все цены")],
         [KeyboardButton("🎯 Мои сделки"), KeyboardButton("📊 Рыночные сигналы")],
         [KeyboardButton("🤖 AI-Советник"), KeyboardButton("📰 События недели")],  # ← ЭТУ СТРОКУ
         [KeyboardButton("➕ Добавить актив"), KeyboardButton("🆕 Новая сделка")],
         [KeyboardButton("👤 Мой профиль"), KeyboardButton("ℹ️ Помощь")],
+    ],
+    resize_keyboard=True,
+)
+ASSET_TYPE_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📊 Акции / ETF", callback_data="asset_stocks")],
+    [InlineKeyboardButton("₿ Криптовалюты", callback_data="asset_crypto")],
+])
+STOCK_SELECT_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton(f"{info['name']} ({ticker})", callback_data=f"addticker_{ticker}")]
+    for ticker, info in AVAILABLE_TICKERS.items()
+])
+CRYPTO_SELECT_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton(f"{info['name']} ({symbol})", callback_data=f"addcrypto_{symbol}")]
+    for symbol, info in CRYPTO_IDS.items()
+])
+CRYPTO_TRADE_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton(f"{info['name']} ({symbol})", callback_data=f"trade_{symbol}")]
+    for symbol, info in CRYPTO_IDS.items()
+])
+
+def _profile_view(current_type: str, compact: bool) -> Tuple[str, InlineKeyboardMarkup]:
+    keyboard = [
+        [
+            InlineKeyboardButton(
+                f"{'✅ ' if t_key == current_type else ''}{t_info['emoji']} {t_info['name']}",
+                callback_data=f"profile_{t_key}",
+            )
+        ]
+        for t_key, t_info in INVESTOR_TYPES.items()
     ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    keyboard.append(
+        [
+            InlineKeyboardButton(
+                f"📱 Компактные цены: {'вкл' if compact else 'выкл'}",
+                callback_data="view_toggle",
+            )
+        ]
+    )
+    cur_info = INVESTOR_TYPES[current_type]
+    text = (
+        f"👤 <b>Ваш профиль</b>\n\n"
+        f"Текущий: {cur_info['emoji']} <b>{cur_info['name']}</b>\n"
+        f"<i>{cur_info['desc']}</i>\n\n"
+        f"Выберите стиль, чтобы сигналы были персональными:"
+    )
+    return text, InlineKeyboardMarkup(keyboard)
+
+# экран профиля зависит только от (тип инвестора, компактный вид) —
+# все варианты собираем при импорте, хендлер только выбирает готовый
+PROFILE_VIEWS: Dict[Tuple[str, bool], Tuple[str, InlineKeyboardMarkup]] = {
+    (t_key, compact): _profile_view(t_key, compact)
+    for t_key in INVESTOR_TYPES
+    for compact in (False, True)
+}
+PROFILE_UPDATED_TEXT: Dict[str, str] = {
+    t_key: (
+        f"✅ <b>Профиль обновлён!</b>\n\n"
+        f"{t_info['emoji']} <b>{t_info['name']}</b>\n"
+        f"<i>{t_info['desc']}</i>\n\n"
+        "Теперь сигналы и рекомендации адаптированы под твой стиль."
+    )
+    for t_key, t_info in INVESTOR_TYPES.items()
+}
+
+START_TEXT = (
+    "👋 <b>Trading Bot v6</b>\n\n"
+    "<b>Функции:</b>\n"
+    "• 💼 Портфель (акции + крипта)\n"
+    "• 🎯 Сделки с целевой прибылью\n"
+    "• 📊 Рыночные сигналы с теханализом (RSI, MACD, тренд)\n"
+    "• 📰 События недели (макро, отчёты, крипто-сентимент)\n"
+    "• 🔔 Умные алерты (движения цены / цель достигнута)\n\n"
+    "Используй кнопки меню 👇"
+)
+HELP_TEXT = (
+    "ℹ️ <b>Помощь</b>\n\n"
+    "<b>Команды:</b>\n"
+    "• /start — главное меню\n"
+    "• /add TICKER КОЛ-ВО — быстро добавить актив в портфель\n\n"
+    "<b>Кнопки меню:</b>\n"
+    "• 💼 Мой портфель\n"
+    "• 🎯 Мои сделки\n"
+    "• 📊 Рыночные сигналы\n"
+    "• 📰 События недели\n"
+    "• 👤 Мой профиль\n"
+    "• ➕ Добавить актив\n"
+    "• 🆕 Новая сделка\n\n"
+    "<b>Алерты:</b>\n"
+    "• Резкие движения цены (в общий канал)\n"
+    "• Достижение твоей целевой прибыли (лично тебе)\n\n"
+    "<i>Это не финсовет</i>"
+)
+
+def get_main_menu():
+    return MAIN_MENU_KB
 
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
@@ -1714,22 +2679,26 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_profiles[uid] = "long"
 
     await update.message.reply_text(
-        "👋 <b>Trading Bot v6</b>\n\n"
-        "<b>Функции:</b>\n"
-        "• 💼 Портфель (акции + крипта)\n"
-        "• 🎯 Сделки с целевой прибылью\n"
-        "• 📊 Рыночные сигналы с теханализом (RSI, MACD, тренд)\n"
-        "• 📰 События недели (макро, отчёты, крипто-сентимент)\n"
-        "• 🔔 Умные алерты (движения цены / цель достигнута)\n\n"
-        "Используй кнопки меню 👇",
+        START_TEXT,
         parse_mode="HTML",
         reply_markup=get_main_menu(),
     )
 
 async def cmd_portfolio(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
-    portfolio = get_user_portfolio(uid)
-    if not portfolio or all(v == 0 for v in portfolio.values()):
+    portfolio = peek_user_portfolio(uid)
+
+    # один проход: раскладываем по типам, нулевые и неизвестные позиции отбрасываем сразу
+    stock_items: List[Tuple[str, float]] = []
+    crypto_items: List[Tuple[str, float]] = []
+    for asset, qty in portfolio.items():
+        if qty > 0:
+            if asset in AVAILABLE_TICKERS:
+                stock_items.append((asset, qty))
+            elif asset in CRYPTO_IDS:
+                crypto_items.append((asset, qty))
+
+    if not stock_items and not crypto_items:
         await update.message.reply_text(
             "💼 Ваш портфель пуст!\n\nИспользуйте <b>➕ Добавить актив</b>",
             parse_mode="HTML",
@@ -1737,176 +2706,132 @@ async def cmd_portfolio(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     try:
-        async with aiohttp.ClientSession() as session:
-            total_value_usd = 0.0
-            stock_lines = []
-            crypto_lines = []
-            stock_total = 0.0
-            crypto_total = 0.0
-
-            # акции/ETF
-            for ticker, qty in portfolio.items():
-                if ticker not in AVAILABLE_TICKERS or qty <= 0:
-                    continue
-                pdata = await get_yahoo_price(session, ticker)
-                if not pdata:
-                    continue
-                price, cur, chg = pdata
-                value = price * qty
-
-                # для total_value_usd делаем грубую конверсию
-                if cur == "USD":
-                    total_value_usd += value
-                    stock_total += value
-                elif cur == "EUR":
-                    total_value_usd += value * 1.1
-                    stock_total += value * 1.1
-                else:
-                    total_value_usd += value
-                    stock_total += value
-
-                arrow = "📈" if chg is not None and chg >= 0 else "📉"
-                stock_lines.append(
-                    f"{AVAILABLE_TICKERS[ticker]['name']}  {qty:.2f} шт\n"
-                    f"├ {price:.2f} {cur} {arrow} {chg:+.1f}%\n"
-                    f"└ Стоимость: {value:,.2f} {cur}"
-                )
-                await asyncio.sleep(0.15)
+        session = await get_session()
 
-            # крипта
-            for symbol, qty in portfolio.items():
-                if symbol not in CRYPTO_IDS or qty <= 0:
-                    continue
-                cdata = await get_crypto_price(session, symbol)
-                if not cdata:
-                    continue
-                price = cdata["usd"]
-                chg = cdata.get("change_24h")
-                value = price * qty
-                total_value_usd += value
-                crypto_total += value
-                arrow = ""
-                if chg is not None:
-                    arrow = "📈" if chg >= 0 else "📉"
-                crypto_lines.append(
-                    f"{symbol}  {qty:.4f}\n"
-                    f"├ ${price:,.2f} {arrow} {f'{chg:+.1f}%' if chg is not None else ''}\n"
-                    f"└ Стоимость: ${value:,.2f}"
-                )
-                await asyncio.sleep(0.15)
+        # акции и крипта параллельно
+        stock_prices, crypto_prices = await asyncio.gather(
+            get_many_yahoo_prices(session, (t for t, _ in stock_items)),
+            get_many_crypto_prices(session, (s for s, _ in crypto_items)),
+        )
+
+        # SoA: позиции с найденной ценой раскладываем в колонки,
+        # стоимость, пересчёт в USD (грубый, по FX_TO_USD) и суммы — numpy-выражениями
+        stock_rows = [
+            (ticker, qty, stock_prices[ticker])
+            for ticker, qty in stock_items
+            if stock_prices.get(ticker)
+        ]
+        crypto_rows = [
+            (symbol, qty, crypto_prices[symbol])
+            for symbol, qty in crypto_items
+            if crypto_prices.get(symbol)
+        ]
+        stock_qty = np.array([qty for _, qty, _ in stock_rows], dtype=float)
+        stock_px = np.array([pdata[0] for _, _, pdata in stock_rows], dtype=float)
+        stock_fx = np.array([FX_TO_USD.get(pdata[1], 1.0) for _, _, pdata in stock_rows], dtype=float)
+        crypto_qty = np.array([qty for _, qty, _ in crypto_rows], dtype=float)
+        crypto_px = np.array([cdata["usd"] for _, _, cdata in crypto_rows], dtype=float)
+
+        stock_values = stock_px * stock_qty            # в валюте котировки
+        crypto_values = crypto_px * crypto_qty         # уже в USD
+        stock_total = float((stock_values * stock_fx).sum())
+        crypto_total = float(crypto_values.sum())
+        total_value_usd = stock_total + crypto_total
+
+        # акции/ETF
+        stock_lines = []
+        for (ticker, qty, (price, cur, chg)), value in zip(stock_rows, stock_values.tolist()):
+            arrow = "📈" if chg is not None and chg >= 0 else "📉"
+            stock_lines.append(
+                f"{ASSET_NAMES_HTML[ticker]}  {qty:.2f} шт\n"
+                f"├ {price:.2f} {cur} {arrow} {chg:+.1f}%\n"
+                f"└ Стоимость: {value:,.2f} {cur}"
+            )
+
+        # крипта
+        crypto_lines = []
+        for (symbol, qty, cdata), value in zip(crypto_rows, crypto_values.tolist()):
+            price = cdata["usd"]
+            chg = cdata.get("change_24h")
+            arrow = ""
+            if chg is not None:
+                arrow = "📈" if chg >= 0 else "📉"
+            crypto_lines.append(
+                f"{symbol}  {qty:.4f}\n"
+                f"├ ${price:,.2f} {arrow} {f'{chg:+.1f}%' if chg is not None else ''}\n"
+                f"└ Стоимость: ${value:,.2f}"
+            )
 
         lines: List[str] = []
         lines.append("💼 <b>ВАШ ПОРТФЕЛЬ</b>")
-        lines.append("━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+        lines.append(SEP)
         if stock_lines:
             lines.append("\n📊 <b>АКЦИИ / ETF</b>")
-            lines.append("━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+            lines.append(SEP)
             lines.extend(stock_lines)
         if crypto_lines:
             lines.append("\n₿ <b>КРИПТОВАЛЮТЫ</b>")
-            lines.append("━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+            lines.append(SEP)
             lines.extend(crypto_lines)
 
         if total_value_usd > 0:
             stock_pct = (stock_total / total_value_usd) * 100 if total_value_usd else 0
             crypto_pct = (crypto_total / total_value_usd) * 100 if total_value_usd else 0
-            lines.append("\n━━━━━━━━━━━━━━━━━━━━━━━━━━━")
-            lines.append("💰 <b>ИТОГО</b>")
-            lines.append("━━━━━━━━━━━━━━━━━━━━━━━━━━━")
-            lines.append(f"Общая стоимость: ${total_value_usd:,.2f}")
-            lines.append("")
-            lines.append("📊 Распределение:")
-            lines.append(f"  Акции:  {stock_pct:.1f}% {_bar(stock_pct)}")
-            lines.append(f"  Крипта: {crypto_pct:.1f}% {_bar_blue(crypto_pct)}")
+            lines.append(
+                f"\n{SEP}\n"
+                "💰 <b>ИТОГО</b>\n"
+                f"{SEP}\n"
+                f"Общая стоимость: ${total_value_usd:,.2f}\n"
+                "\n"
+                "📊 Распределение:\n"
+                f"  Акции:  {stock_pct:.1f}% {_bar(stock_pct)}\n"
+                f"  Крипта: {crypto_pct:.1f}% {_bar_blue(crypto_pct)}"
+            )
 
         await update.message.reply_text("\n".join(lines), parse_mode="HTML")
 
-    except Exception as e:
-        print(f"❌ portfolio error: {e}")
-        traceback.print_exc()
+    except Exception:
+        logger.exception("❌ portfolio error")
         await update.message.reply_text("⚠ Ошибка при получении данных")
 
 async def cmd_all_prices(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
-        riga_tz = timezone(timedelta(hours=2))
-        now = datetime.now(riga_tz)
+        now = datetime.now(RIGA_TZ)
         timestamp = now.strftime("%H:%M:%S %d.%m.%Y")
 
-        lines = []
-        lines.append("💹 <b>ВСЕ ЦЕНЫ</b>")
-        lines.append("━━━━━━━━━━━━━━━━━━━━━━━━━━━")
-        lines.append(f"🕐 Данные: <b>{timestamp}</b> (Рига)")
-        lines.append("")
-
-        async with aiohttp.ClientSession() as session:
-            # STOCKS
-            lines.append("📊 <b>Фондовый рынок:</b>")
-            lines.append("━━━━━━━━━━━━━━━━━━━━━━━━━━━")
-            lines.append("<pre>")
-            lines.append("┌──────────────────┬────────────┬─────────┐")
-            lines.append("│ Актив            │ Цена       │ 24h     │")
-            lines.append("├──────────────────┼────────────┼─────────┤")
-            for ticker, info in AVAILABLE_TICKERS.items():
-                pdata = await get_yahoo_price(session, ticker)
-                if pdata:
-                    price, cur, chg = pdata
-                    name = info["name"][:16].ljust(16)
-                    price_str = f"{price:.2f} {cur}".ljust(10)
-                    if chg != 0:
-                        arrow = "↗" if chg >= 0 else "↘"
-                        chg_str = f"{arrow}{abs(chg):.1f}%".rjust(7)
-                    else:
-                        chg_str = "0.0%".rjust(7)
-                else:
-                    name = info["name"][:16].ljust(16)
-                    price_str = "н/д".ljust(10)
-                    chg_str = "N/A".rjust(7)
-
-                lines.append(f"│ {name} │ {price_str} │ {chg_str} │")
-                await asyncio.sleep(0.15)
-            lines.append("└──────────────────┴────────────┴─────────┘")
-            lines.append("</pre>\n")
-
-            # CRYPTO
-            lines.append("₿ <b>Криптовалюты:</b>")
-            lines.append("━━━━━━━━━━━━━━━━━━━━━━━━━━━")
-            lines.append("<pre>")
-            lines.append("┌────────┬──────────────┬─────────┬──────────┐")
-            lines.append("│ Монета │ Цена         │ 24h     │ Источник │")
-            lines.append("├────────┼──────────────┼─────────┼──────────┤")
-
-            for symbol, info in CRYPTO_IDS.items():
-                cdata = await get_crypto_price(session, symbol)
-                if cdata:
-                    price = cdata["usd"]
-                    chg = cdata.get("change_24h")
-                    source = cdata.get("source", "—")[:8]
-                    sym_str = symbol.ljust(6)
-                    price_str = f"${price:,.2f}".ljust(12)
-                    if chg is not None and not math.isnan(chg):
-                        arrow = "↗" if chg >= 0 else "↘"
-                        chg_str = f"{arrow}{abs(chg):.1f}%".rjust(7)
-                    else:
-                        chg_str = "N/A".rjust(7)
-                else:
-                    sym_str = symbol.ljust(6)
-                    price_str = "н/д".ljust(12)
-                    chg_str = "N/A".rjust(7)
-                    source = "—".ljust(8)
-
-                lines.append(
-                    f"│ {sym_str} │ {price_str} │ {chg_str} │ {source.ljust(8)} │"
-                )
-                await asyncio.sleep(0.15)
+        session = await get_session()
+        stock_prices, crypto_prices = await asyncio.gather(
+            get_many_yahoo_prices(session, AVAILABLE_TICKERS),
+            get_many_crypto_prices(session, list(CRYPTO_IDS)),
+        )
 
-            lines.append("└────────┴──────────────┴─────────┴──────────┘")
-            lines.append("</pre>")
+        layout = "plain" if update.effective_user.id in user_compact_view else "table"
+        (stock_head, stock_fmt, stock_foot), (crypto_head, crypto_fmt, crypto_foot) = (
+            ALL_PRICES_LAYOUTS[layout]
+        )
 
-        await update.message.reply_text("\n".join(lines), parse_mode="HTML")
+        # один join по заранее известным кускам вместо десятков append
+        text = "\n".join((
+            "💹 <b>ВСЕ ЦЕНЫ</b>",
+            SEP,
+            f"🕐 Данные: <b>{timestamp}</b> (Рига)",
+            "",
+            "📊 <b>Фондовый рынок:</b>",
+            SEP,
+            *stock_head,
+            *(_stock_row(info["name"], stock_prices.get(ticker), stock_fmt)
+              for ticker, info in AVAILABLE_TICKERS.items()),
+            *stock_foot,
+            "₿ <b>Криптовалюты:</b>",
+            SEP,
+            *crypto_head,
+            *(_crypto_row(symbol, crypto_prices.get(symbol), crypto_fmt) for symbol in CRYPTO_IDS),
+            *crypto_foot,
+        ))
+        await update.message.reply_text(text, parse_mode="HTML")
 
-    except Exception as e:
-        print(f"❌ all_prices error: {e}")
-        traceback.print_exc()
+    except Exception:
+        logger.exception("❌ all_prices error")
         await update.message.reply_text("⚠ Ошибка при получении данных")
 
 async def cmd_my_trades(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1923,104 +2848,172 @@ async def cmd_my_trades(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("🔄 Обновляю данные...")
 
         lines = []
-        total_value = 0.0
-        total_profit = 0.0
-
-        async with aiohttp.ClientSession() as session:
-            for i, tr in enumerate(trades, start=1):
-                try:
-                    symbol = tr["symbol"]
-                    entry_price = float(tr["entry_price"])
-                    amount = float(tr["amount"])
-                    target = float(tr["target_profit_pct"])
-                    created_ts = tr.get("timestamp")
-                except Exception:
-                    continue
-
-                cdata = await get_crypto_price(session, symbol)
-                if not cdata:
-                    continue
-                current_price = cdata["usd"]
-                try:
-                    profit_pct = ((current_price - entry_price) / entry_price) * 100
-                except ZeroDivisionError:
-                    profit_pct = 0.0
 
-                profit_usd = amount * (current_price - entry_price)
-                value_now = amount * current_price
-
-                total_value += value_now
-                total_profit += profit_usd
+        session = await get_session()
+        crypto_prices = await get_many_crypto_prices(
+            session, [tr.get("symbol") for tr in trades]
+        )
 
-                # статус
-                if profit_pct >= target:
-                    status = "🎉 ЦЕЛЬ ДОСТИГНУТА!"
-                    rec = "🟢 ПРОДАВАТЬ СЕЙЧАС"
-                elif profit_pct > 0:
-                    status = "📈 ПРИБЫЛЬ"
-                    rec = "Держать / подтяни стоп"
-                else:
-                    status = "📉 УБЫТОК"
-                    rec = "Подумай: усреднять или выйти"
+        # SoA: сначала разбираем сделки в параллельные колонки,
+        # потом вся арифметика и суммы — одним numpy-выражением
+        rows: List[Tuple[int, str, Optional[str]]] = []  # (номер, symbol, timestamp)
+        entries: List[float] = []
+        amounts: List[float] = []
+        targets: List[float] = []
+        currents: List[float] = []
+        for i, tr in enumerate(trades, start=1):
+            try:
+                symbol = tr["symbol"]
+                entry_price = float(tr["entry_price"])
+                amount = float(tr["amount"])
+                target = float(tr["target_profit_pct"])
+            except Exception:
+                continue
+            cdata = crypto_prices.get(symbol)
+            if not cdata:
+                continue
+            rows.append((i, symbol, tr.get("timestamp")))
+            entries.append(entry_price)
+            amounts.append(amount)
+            targets.append(target)
+            currents.append(cdata["usd"])
+
+        entry_arr = np.array(entries, dtype=float)
+        amount_arr = np.array(amounts, dtype=float)
+        current_arr = np.array(currents, dtype=float)
+        diff_arr = current_arr - entry_arr
+        pct_arr = np.divide(
+            diff_arr * 100, entry_arr,
+            out=np.zeros_like(diff_arr), where=entry_arr != 0,
+        )
+        profit_arr = amount_arr * diff_arr
+        value_arr = amount_arr * current_arr
+        total_value = float(value_arr.sum())
+        total_profit = float(profit_arr.sum())
+
+        for k, (i, symbol, created_ts) in enumerate(rows):
+            entry_price = entries[k]
+            amount = amounts[k]
+            target = targets[k]
+            current_price = currents[k]
+            profit_pct = float(pct_arr[k])
+            profit_usd = float(profit_arr[k])
+            value_now = float(value_arr[k])
+
+            # статус
+            if profit_pct >= target:
+                status = "🎉 ЦЕЛЬ ДОСТИГНУТА!"
+                rec = "🟢 ПРОДАВАТЬ СЕЙЧАС"
+            elif profit_pct > 0:
+                status = "📈 ПРИБЫЛЬ"
+                rec = "Держать / подтяни стоп"
+            else:
+                status = "📉 УБЫТОК"
+                rec = "Подумай: усреднять или выйти"
 
-                # прогресс к цели
-                goal_progress = min(max(profit_pct / target, 0.0), 1.0) if target > 0 else 0.0
-                goal_bar_blocks = round(goal_progress * 10)
-                goal_bar = "🟩" * goal_bar_blocks + "⬜" * (10 - goal_bar_blocks)
+            # прогресс к цели
+            goal_progress = min(max(profit_pct / target, 0.0), 1.0) if target > 0 else 0.0
+            goal_bar_blocks = round(goal_progress * 10)
+            goal_bar = "🟩" * goal_bar_blocks + "⬜" * (10 - goal_bar_blocks)
 
-                # сколько дней в сделке
-                days_in_trade = "n/a"
-                if created_ts:
-                    try:
-                        dt_open = datetime.fromisoformat(created_ts.replace("Z", "+00:00"))
-                        days_in_trade = (datetime.utcnow() - dt_open).days
-                        days_in_trade = f"{days_in_trade} дн."
-                    except Exception:
-                        pass
+            # сколько дней в сделке
+            days_in_trade = "n/a"
+            if created_ts:
+                try:
+                    dt_open = datetime.fromisoformat(created_ts.replace("Z", "+00:00"))
+                    days_in_trade = (datetime.utcnow() - dt_open).days
+                    days_in_trade = f"{days_in_trade} дн."
+                except Exception:
+                    pass
 
-                # UI-блок сделки
-                lines.append(f"✅ <b>#{i} · {symbol}</b>")
-                lines.append("━━━━━━━━━━━━━━━━━━━━━━━━━━━")
-                lines.append(f"Статус: {status}")
-                lines.append("")
-                lines.append("💰 Позиция:")
-                lines.append(f"  ├ Количество: {amount:.4f} {symbol}")
-                lines.append(f"  ├ Вход: ${entry_price:,.2f}")
-                lines.append(f"  ├ Сейчас: ${current_price:,.2f}")
-                lines.append(f"  └ Стоимость: ${value_now:,.2f}")
-                lines.append("")
-                lines.append("📊 Результат:")
-                lines.append(f"  ├ Прибыль: {profit_pct:+.2f}% (${profit_usd:+,.2f})")
-                lines.append(f"  ├ Цель: +{target:.2f}%")
-                lines.append(f"  └ Прогресс: {goal_bar} {(goal_progress*100):.0f}%")
-                lines.append("")
-                lines.append("💡 Рекомендация:")
-                lines.append(f"  {rec}")
-                lines.append("")
-                lines.append(f"⏰ В сделке: {days_in_trade}")
-                lines.append("")
-
-                await asyncio.sleep(0.15)
+            # UI-блок сделки — одной строкой, итоговый join склеит блоки
+            lines.append(
+                f"✅ <b>#{i} · {symbol}</b>\n"
+                f"{SEP}\n"
+                f"Статус: {status}\n"
+                "\n"
+                "💰 Позиция:\n"
+                f"  ├ Количество: {amount:.4f} {symbol}\n"
+                f"  ├ Вход: ${entry_price:,.2f}\n"
+                f"  ├ Сейчас: ${current_price:,.2f}\n"
+                f"  └ Стоимость: ${value_now:,.2f}\n"
+                "\n"
+                "📊 Результат:\n"
+                f"  ├ Прибыль: {profit_pct:+.2f}% (${profit_usd:+,.2f})\n"
+                f"  ├ Цель: +{target:.2f}%\n"
+                f"  └ Прогресс: {goal_bar} {(goal_progress*100):.0f}%\n"
+                "\n"
+                "💡 Рекомендация:\n"
+                f"  {rec}\n"
+                "\n"
+                f"⏰ В сделке: {days_in_trade}\n"
+            )
 
         if total_value > 0:
             initial_value = total_value - total_profit
             if initial_value > 0:
                 total_profit_pct = (total_profit / initial_value) * 100
-                lines.append("━━━━━━━━━━━━━━━━━━━━━━━━━━━")
-                lines.append("💼 <b>Сводка по всем сделкам</b>")
-                lines.append("━━━━━━━━━━━━━━━━━━━━━━━━━━━")
-                lines.append(f"Общая стоимость: ${total_value:,.2f}")
                 lines.append(
+                    f"{SEP}\n"
+                    "💼 <b>Сводка по всем сделкам</b>\n"
+                    f"{SEP}\n"
+                    f"Общая стоимость: ${total_value:,.2f}\n"
                     f"Общая прибыль: {total_profit_pct:+.2f}% (${total_profit:+,.2f})"
                 )
 
-        await update.message.reply_text("\n".join(lines), parse_mode="HTML")
+        # ни одна сделка не получила цену -> показывать нечего
+        if not lines:
+            await update.message.reply_text("⚠ Не удалось получить цены")
+            return
 
-    except Exception as e:
-        print(f"❌ my_trades error: {e}")
-        traceback.print_exc()
+        # обычно это одно сообщение; при длинном списке сделок режем по границам блоков,
+        # иначе Telegram отклонит всё целиком (лимит 4096 символов)
+        for text in _pack_messages(lines):
+            await update.message.reply_text(text, parse_mode="HTML")
+
+    except Exception:
+        logger.exception("❌ my_trades error")
         await update.message.reply_text("⚠ Ошибка при получении данных")
 
+SIGNALS_TITLE = f"📊 <b>РЫНОЧНЫЕ СИГНАЛЫ</b>\n{SEP}"
+
+# интерпретация сигнала: (BUY / SELL / HOLD) x тип инвестора, собрано один раз
+_SIGNAL_ADVICE_BUY = "   Рынок даёт точку входа.\n"
+_SIGNAL_ADVICE_SELL = "   Рынок перегрет / риск коррекции.\n"
+SIGNAL_ADVICE: Dict[Tuple[str, str], str] = {
+    ("buy", "long"): _SIGNAL_ADVICE_BUY + "   Для долгосрока: усреднить вниз/докупить.\n",
+    ("buy", "swing"): _SIGNAL_ADVICE_BUY + "   Для свинга: можно открывать позицию на импульс.\n",
+    ("buy", "day"): _SIGNAL_ADVICE_BUY + "   Для внутридня: играть от лонга, но стоп обязателен.\n",
+    ("sell", "long"): _SIGNAL_ADVICE_SELL + "   Долгосрок обычно не паникует. Но можно частично зафиксировать.\n",
+    ("sell", "swing"): _SIGNAL_ADVICE_SELL + "   Для свинга: фиксировать профит, ждать отката.\n",
+    ("sell", "day"): _SIGNAL_ADVICE_SELL + "   Для внутридня: шорт/фиксация, не жадничай.\n",
+}
+SIGNAL_ADVICE_HOLD = "   Нейтрально. Просто держать и не дёргаться.\n"
+SIGNAL_SIDE = {"STRONG BUY": "buy", "BUY": "buy", "SELL": "sell", "STRONG SELL": "sell"}
+
+def _signal_block(symbol: str, sig: Dict[str, Any], inv_type: str) -> str:
+    label = sig["signal"]
+    score = sig["score"]
+    conf = _confidence_stars(score)
+    side = SIGNAL_SIDE.get(label)
+    if side is None:
+        advice = SIGNAL_ADVICE_HOLD
+    else:
+        # всё, что не long/swing, считается внутридневным
+        advice = SIGNAL_ADVICE[side, inv_type if inv_type in ("long", "swing") else "day"]
+    reasons = "".join(f"  ├ {rl}\n" for rl in sig["reason_lines"])
+    return (
+        f"{SEP}\n"
+        f"₿ <b>{symbol}</b>\n"
+        f"{SEP}\n"
+        f"🎯 Сигнал: {sig['emoji']} <b>{label}</b> (Score: {score:.0f}/100)\n"
+        f"🎲 Уверенность: {conf} ({len(conf)}/5)\n\n"
+        f"📊 Технический анализ:\n"
+        f"{reasons}\n"
+        f"💡 Интерпретация:\n"
+        f"{advice}\n"
+    )
+
 async def cmd_market_signals(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
     inv_type = user_profiles.get(uid, "long")
@@ -2031,110 +3024,44 @@ async def cmd_market_signals(update: Update, context: ContextTypes.DEFAULT_TYPE)
     )
 
     try:
-        async with aiohttp.ClientSession() as session:
-            fg_val = await get_fear_greed_index(session)
-            # Заголовок
-            header_lines = []
-            header_lines.append("📊 <b>РЫНОЧНЫЕ СИГНАЛЫ</b>")
-            header_lines.append("━━━━━━━━━━━━━━━━━━━━━━━━━━━")
-            header_lines.append(f"👤 Ваш профиль: {inv_info['emoji']} <b>{inv_info['name']}</b>")
-            header_lines.append(f"<i>{inv_info['desc']}</i>")
-            header_lines.append("")
-
-            if fg_val is not None:
-                if fg_val < 25:
-                    fg_status = "😱 Экстремальный страх"
-                elif fg_val < 45:
-                    fg_status = "😰 Страх"
-                elif fg_val < 55:
-                    fg_status = "😐 Нейтрально"
-                elif fg_val < 75:
-                    fg_status = "😃 Жадность"
-                else:
-                    fg_status = "🤑 Экстремальная жадность"
-                header_lines.append(f"📈 Fear & Greed: <b>{fg_val}/100</b> ({fg_status})")
-                header_lines.append("")
-            else:
-                header_lines.append("📈 Fear & Greed: n/a")
-                header_lines.append("")
-
-            # Сигналы по топам
-            body_lines = []
-            for symbol in ["BTC", "ETH", "SOL", "AVAX"]:
-                sig = await build_signal_for_symbol(session, symbol, inv_type)
-                label = sig["signal"]
-                emoji = sig["emoji"]
-                score = sig["score"]
-                conf = _confidence_stars(score)
-
-                body_lines.append(f"━━━━━━━━━━━━━━━━━━━━━━━━━━━")
-                body_lines.append(f"₿ <b>{symbol}</b>")
-                body_lines.append("━━━━━━━━━━━━━━━━━━━━━━━━━━━")
-                body_lines.append(f"🎯 Сигнал: {emoji} <b>{label}</b> (Score: {score:.0f}/100)")
-                body_lines.append(f"🎲 Уверенность: {conf} ({len(conf)}/5)")
-                body_lines.append("")
-                body_lines.append("📊 Технический анализ:")
-                for rl in sig["reason_lines"]:
-                    body_lines.append(f"  ├ {rl}")
-                body_lines.append("")
-                body_lines.append("💡 Интерпретация:")
-                if label in ("STRONG BUY", "BUY"):
-                    body_lines.append("   Рынок даёт точку входа.")
-                    if inv_type == "long":
-                        body_lines.append("   Для долгосрока: усреднить вниз/докупить.")
-                    elif inv_type == "swing":
-                        body_lines.append("   Для свинга: можно открывать позицию на импульс.")
-                    else:
-                        body_lines.append("   Для внутридня: играть от лонга, но стоп обязателен.")
-                elif label in ("SELL", "STRONG SELL"):
-                    body_lines.append("   Рынок перегрет / риск коррекции.")
-                    if inv_type == "long":
-                        body_lines.append("   Долгосрок обычно не паникует. Но можно частично зафиксировать.")
-                    elif inv_type == "swing":
-                        body_lines.append("   Для свинга: фиксировать профит, ждать отката.")
-                    else:
-                        body_lines.append("   Для внутридня: шорт/фиксация, не жадничай.")
-                else:
-                    body_lines.append("   Нейтрально. Просто держать и не дёргаться.")
-                body_lines.append("")
-
-                await asyncio.sleep(0.2)
+        session = await get_session()
+        # F&G и TA по всем символам — одним gather, сеть не ждёт сама себя;
+        # сигналы считаем уже по готовым данным, выводим в исходном порядке
+        fg_val, ta_results = await asyncio.gather(
+            get_fear_greed_index(session),
+            asyncio.gather(*(calculate_technical_indicators(session, s) for s in SIGNAL_SYMBOLS)),
+        )
 
-        footer_lines = []
-        footer_lines.append("<i>⚠️ Это не финансовая рекомендация</i>")
+        if fg_val is not None:
+            fg_line = f"📈 Fear & Greed: <b>{fg_val}/100</b> ({_fear_greed_status(fg_val)})"
+        else:
+            fg_line = "📈 Fear & Greed: n/a"
 
-        final_msg = "\n".join(header_lines + body_lines + footer_lines)
+        blocks = "".join(
+            _signal_block(symbol, _score_signal(symbol, inv_type, fg_val, ta_data), inv_type)
+            for symbol, ta_data in zip(SIGNAL_SYMBOLS, ta_results)
+        )
+        final_msg = (
+            f"{SIGNALS_TITLE}\n"
+            f"👤 Ваш профиль: {inv_info['emoji']} <b>{inv_info['name']}</b>\n"
+            f"<i>{inv_info['desc']}</i>\n\n"
+            f"{fg_line}\n\n"
+            f"{blocks}"
+            "<i>⚠️ Это не финансовая рекомендация</i>"
+        )
         await update.message.reply_text(final_msg, parse_mode="HTML")
 
-    except Exception as e:
-        print(f"❌ market_signals error: {e}")
-        traceback.print_exc()
+    except Exception:
+        logger.exception("❌ market_signals error")
         await update.message.reply_text("⚠ Ошибка при получении сигналов")
 
 async def cmd_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
     current_type = user_profiles.get(uid, "long")
-
-    keyboard = []
-    for t_key, t_info in INVESTOR_TYPES.items():
-        selected = "✅ " if t_key == current_type else ""
-        keyboard.append(
-            [
-                InlineKeyboardButton(
-                    f"{selected}{t_info['emoji']} {t_info['name']}",
-                    callback_data=f"profile_{t_key}",
-                )
-            ]
-        )
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    cur_info = INVESTOR_TYPES[current_type]
+    text, reply_markup = PROFILE_VIEWS[current_type, uid in user_compact_view]
 
     await update.message.reply_text(
-        f"👤 <b>Ваш профиль</b>\n\n"
-        f"Текущий: {cur_info['emoji']} <b>{cur_info['name']}</b>\n"
-        f"<i>{cur_info['desc']}</i>\n\n"
-        f"Выберите стиль, чтобы сигналы были персональными:",
+        text,
         parse_mode="HTML",
         reply_markup=reply_markup,
     )
@@ -2146,15 +3073,22 @@ async def profile_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
     inv_type = query.data.replace("profile_", "")
     uid = query.from_user.id
     user_profiles[uid] = inv_type
-    t_info = INVESTOR_TYPES[inv_type]
 
-    await query.edit_message_text(
-        f"✅ <b>Профиль обновлён!</b>\n\n"
-        f"{t_info['emoji']} <b>{t_info['name']}</b>\n"
-        f"<i>{t_info['desc']}</i>\n\n"
-        "Теперь сигналы и рекомендации адаптированы под твой стиль.",
-        parse_mode="HTML",
-    )
+    await query.edit_message_text(PROFILE_UPDATED_TEXT[inv_type], parse_mode="HTML")
+
+async def view_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    uid = query.from_user.id
+    if uid in user_compact_view:
+        user_compact_view.discard(uid)
+        text = "🧾 /all_prices снова таблицами"
+    else:
+        user_compact_view.add(uid)
+        text = "📱 /all_prices теперь компактным списком — удобнее на телефоне"
+
+    await query.edit_message_text(f"✅ <b>Готово!</b>\n\n{text}", parse_mode="HTML")
 
 # --- Добавление актива в портфель (быстрая команда /add)
 
@@ -2189,11 +3123,7 @@ async def cmd_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
     pf[ticker] = old + qty
     save_portfolio_hybrid(uid, pf)
 
-    name = (
-        AVAILABLE_TICKERS.get(ticker, {}).get("name")
-        or CRYPTO_IDS.get(ticker, {}).get("name")
-        or ticker
-    )
+    name = ASSET_NAMES_HTML.get(ticker) or _h(ticker)
     await update.message.reply_text(
         f"✅ Добавлено: <b>{qty} {name}</b>\n"
         f"Теперь у вас: {pf[ticker]:.4f}",
@@ -2203,14 +3133,10 @@ async def cmd_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # --- Диалог 'Добавить актив' через кнопки ---
 
 async def cmd_add_asset(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    kb = [
-        [InlineKeyboardButton("📊 Акции / ETF", callback_data="asset_stocks")],
-        [InlineKeyboardButton("₿ Криптовалюты", callback_data="asset_crypto")],
-    ]
     await update.message.reply_text(
         "➕ <b>Добавить актив</b>\n\nВыберите тип:",
         parse_mode="HTML",
-        reply_markup=InlineKeyboardMarkup(kb),
+        reply_markup=ASSET_TYPE_KB,
     )
     return SELECT_ASSET_TYPE
 
@@ -2221,32 +3147,19 @@ async def add_asset_select_type(update: Update, context: ContextTypes.DEFAULT_TY
     asset_type = q.data.replace("asset_", "")
     context.user_data["asset_type"] = asset_type
 
-    kb = []
     if asset_type == "stocks":
         context.user_data["asset_category"] = "stocks"
-        for ticker, info in AVAILABLE_TICKERS.items():
-            kb.append([
-                InlineKeyboardButton(
-                    f"{info['name']} ({ticker})",
-                    callback_data=f"addticker_{ticker}"
-                )
-            ])
+        kb = STOCK_SELECT_KB
         type_emoji = "📊"; type_name = "Акции / ETF"
     else:
         context.user_data["asset_category"] = "crypto"
-        for symbol, info in CRYPTO_IDS.items():
-            kb.append([
-                InlineKeyboardButton(
-                    f"{info['name']} ({symbol})",
-                    callback_data=f"addcrypto_{symbol}"
-                )
-            ])
+        kb = CRYPTO_SELECT_KB
         type_emoji = "₿"; type_name = "Криптовалюты"
 
     await q.edit_message_text(
         f"{type_emoji} <b>{type_name}</b>\n\nВыберите актив:",
         parse_mode="HTML",
-        reply_markup=InlineKeyboardMarkup(kb),
+        reply_markup=kb,
     )
     return SELECT_ASSET
 
@@ -2255,15 +3168,12 @@ async def add_asset_select_item(update: Update, context: ContextTypes.DEFAULT_TY
     await q.answer()
 
     if q.data.startswith("addticker_"):
-        ticker = q.data.replace("addticker_", "")
-        context.user_data["selected_asset"] = ticker
-        name = AVAILABLE_TICKERS[ticker]["name"]
-        emoji = "📊"
+        asset = q.data.replace("addticker_", "")
     else:
-        symbol = q.data.replace("addcrypto_", "")
-        context.user_data["selected_asset"] = symbol
-        name = CRYPTO_IDS[symbol]["name"]
-        emoji = "₿"
+        asset = q.data.replace("addcrypto_", "")
+    context.user_data["selected_asset"] = asset
+    name = ASSET_NAMES_HTML[asset]
+    emoji = ASSET_EMOJI[asset]
 
     await q.edit_message_text(
         f"✅ Выбрано: {emoji} <b>{name}</b>\n\nВведите количество:",
@@ -2272,45 +3182,36 @@ async def add_asset_select_item(update: Update, context: ContextTypes.DEFAULT_TY
     return ENTER_ASSET_AMOUNT
 
 async def add_asset_enter_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        amount = float(update.message.text.replace(",", "."))
-        if amount <= 0:
-            raise ValueError()
-        uid = update.effective_user.id
-        asset = context.user_data["selected_asset"]
-        category = context.user_data["asset_category"]
-
-        if category == "stocks":
-            name = AVAILABLE_TICKERS[asset]["name"]
-            emoji = "📊"
-        else:
-            name = CRYPTO_IDS[asset]["name"]
-            emoji = "₿"
-
-        pf = get_user_portfolio(uid)
-        old_amount = pf.get(asset, 0)
-        pf[asset] = old_amount + amount
-        save_portfolio_hybrid(uid, pf)
-
-        await update.message.reply_text(
-            f"✅ <b>Добавлено!</b>\n\n"
-            f"{emoji} <b>{name}</b>\n"
-            f"Добавлено: {amount:.4f}\n"
-            f"Было: {old_amount:.4f}\n"
-            f"Стало: {pf[asset]:.4f}",
-            parse_mode="HTML",
-            reply_markup=get_main_menu(),
-        )
-        context.user_data.clear()
-        return ConversationHandler.END
-
-    except Exception:
+    amount = _positive_number(update.message.text.replace(",", "."))
+    if amount is None:
         await update.message.reply_text(
             "❌ Введите число\nНапример: <code>10</code> или <code>0.5</code>",
             parse_mode="HTML",
         )
         return ENTER_ASSET_AMOUNT
 
+    uid = update.effective_user.id
+    asset = context.user_data["selected_asset"]
+    name = ASSET_NAMES_HTML[asset]
+    emoji = ASSET_EMOJI[asset]
+
+    pf = get_user_portfolio(uid)
+    old_amount = pf.get(asset, 0)
+    pf[asset] = old_amount + amount
+    save_portfolio_hybrid(uid, pf)
+
+    await update.message.reply_text(
+        f"✅ <b>Добавлено!</b>\n\n"
+        f"{emoji} <b>{name}</b>\n"
+        f"Добавлено: {amount:.4f}\n"
+        f"Было: {old_amount:.4f}\n"
+        f"Стало: {pf[asset]:.4f}",
+        parse_mode="HTML",
+        reply_markup=get_main_menu(),
+    )
+    context.user_data.clear()
+    return ConversationHandler.END
+
 async def add_asset_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("❌ Отменено", reply_markup=get_main_menu())
     context.user_data.clear()
@@ -2319,15 +3220,10 @@ async def add_asset_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # --- Диалог 'Новая сделка' ---
 
 async def cmd_new_trade(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    kb = []
-    for symbol, info in CRYPTO_IDS.items():
-        kb.append(
-            [InlineKeyboardButton(f"{info['name']} ({symbol})", callback_data=f"trade_{symbol}")]
-        )
     await update.message.reply_text(
         "🆕 <b>Новая сделка</b>\n\nВыберите криптовалюту:",
         parse_mode="HTML",
-        reply_markup=InlineKeyboardMarkup(kb),
+        reply_markup=CRYPTO_TRADE_KB,
     )
     return SELECT_CRYPTO
 
@@ -2344,43 +3240,39 @@ async def trade_select_crypto(update: Update, context: ContextTypes.DEFAULT_TYPE
     return ENTER_AMOUNT
 
 async def trade_enter_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        amount = float(update.message.text.replace(",", "."))
-        if amount <= 0:
-            raise ValueError()
-        context.user_data["trade_amount"] = amount
-
-        symbol = context.user_data["trade_symbol"]
-        await update.message.reply_text("🔄 Получаю цену...")
-
-        async with aiohttp.ClientSession() as session:
-            cdata = await get_crypto_price(session, symbol, use_cache=False)
-
-        if cdata:
-            current_price = cdata["usd"]
-            context.user_data["trade_price"] = current_price
-            kb = [[InlineKeyboardButton(
-                f"➡️ Продолжить с ${current_price:,.4f}",
-                callback_data="price_continue"
-            )]]
-            await update.message.reply_text(
-                f"✅ Количество: <b>{amount:.4f}</b>\n\n"
-                f"Цена: <b>${current_price:,.4f}</b>\n\n"
-                f"Нажми кнопку или введи свою цену:",
-                parse_mode="HTML",
-                reply_markup=InlineKeyboardMarkup(kb),
-            )
-        else:
-            await update.message.reply_text(
-                f"✅ Количество: <b>{amount:.4f}</b>\n\n"
-                f"Введите цену покупки (USD):",
-                parse_mode="HTML",
-            )
-        return ENTER_PRICE
-
-    except Exception:
+    amount = _positive_number(update.message.text.replace(",", "."))
+    if amount is None:
         await update.message.reply_text("❌ Введите число")
         return ENTER_AMOUNT
+    context.user_data["trade_amount"] = amount
+
+    symbol = context.user_data["trade_symbol"]
+    await update.message.reply_text("🔄 Получаю цену...")
+
+    session = await get_session()
+    cdata = await get_crypto_price(session, symbol, use_cache=False)
+
+    if cdata:
+        current_price = cdata["usd"]
+        context.user_data["trade_price"] = current_price
+        kb = [[InlineKeyboardButton(
+            f"➡️ Продолжить с ${current_price:,.4f}",
+            callback_data="price_continue"
+        )]]
+        await update.message.reply_text(
+            f"✅ Количество: <b>{amount:.4f}</b>\n\n"
+            f"Цена: <b>${current_price:,.4f}</b>\n\n"
+            f"Нажми кнопку или введи свою цену:",
+            parse_mode="HTML",
+            reply_markup=InlineKeyboardMarkup(kb),
+        )
+    else:
+        await update.message.reply_text(
+            f"✅ Количество: <b>{amount:.4f}</b>\n\n"
+            f"Введите цену покупки (USD):",
+            parse_mode="HTML",
+        )
+    return ENTER_PRICE
 
 async def trade_enter_price(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # вариант кнопки
@@ -2397,50 +3289,42 @@ async def trade_enter_price(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return ENTER_TARGET
 
     # ручной ввод
-    try:
-        price = float(update.message.text.replace(",", ""))
-        if price <= 0:
-            raise ValueError()
-        context.user_data["trade_price"] = price
-
-        await update.message.reply_text(
-            f"✅ Цена: <b>${price:,.4f}</b>\n\nВведите целевую прибыль (%):",
-            parse_mode="HTML",
-        )
-        return ENTER_TARGET
-
-    except Exception:
+    price = _positive_number(update.message.text.replace(",", ""))
+    if price is None:
         await update.message.reply_text("❌ Введите число")
         return ENTER_PRICE
+    context.user_data["trade_price"] = price
 
-async def trade_enter_target(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        target = float(update.message.text)
-        if target <= 0:
-            raise ValueError()
+    await update.message.reply_text(
+        f"✅ Цена: <b>${price:,.4f}</b>\n\nВведите целевую прибыль (%):",
+        parse_mode="HTML",
+    )
+    return ENTER_TARGET
 
-        uid = update.effective_user.id
-        symbol = context.user_data["trade_symbol"]
-        amount = context.user_data["trade_amount"]
-        price = context.user_data["trade_price"]
+async def trade_enter_target(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    target = _positive_number(update.message.text)
+    if target is None:
+        await update.message.reply_text("❌ Введите число")
+        return ENTER_TARGET
 
-        add_trade_hybrid(uid, symbol, amount, price, target)
+    uid = update.effective_user.id
+    symbol = context.user_data["trade_symbol"]
+    amount = context.user_data["trade_amount"]
+    price = context.user_data["trade_price"]
 
-        await update.message.reply_text(
-            "✅ <b>Сделка добавлена!</b>\n\n"
-            f"💰 {symbol}\n"
-            f"Кол-во: {amount:.4f}\n"
-            f"Цена: ${price:,.2f}\n"
-            f"Цель: +{target}%",
-            parse_mode="HTML",
-            reply_markup=get_main_menu(),
-        )
-        context.user_data.clear()
-        return ConversationHandler.END
+    add_trade_hybrid(uid, symbol, amount, price, target)
 
-    except Exception:
-        await update.message.reply_text("❌ Введите число")
-        return ENTER_TARGET
+    await update.message.reply_text(
+        "✅ <b>Сделка добавлена!</b>\n\n"
+        f"💰 {symbol}\n"
+        f"Кол-во: {amount:.4f}\n"
+        f"Цена: ${price:,.2f}\n"
+        f"Цель: +{target}%",
+        parse_mode="HTML",
+        reply_markup=get_main_menu(),
+    )
+    context.user_data.clear()
+    return ConversationHandler.END
 
 async def trade_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("❌ Отменено", reply_markup=get_main_menu())
@@ -2449,70 +3333,81 @@ async def trade_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # --- События недели (динамические с Finnhub) ---
 
+async def refresh_calendar_job(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Ночной прогрев календарей Finnhub (и их общей отрисовки): к первому
+    /events за день данные уже в кэше, пользователь не ждёт сеть.
+    """
+    if not FINNHUB_API_KEY:
+        return
+    session = await get_session()
+    econ, earns = await asyncio.gather(
+        get_economic_calendar(session, days=7),
+        get_earnings_calendar(session, days=7),
+    )
+    _render_calendar_sections(econ, earns)
+    logger.info("📰 calendars refreshed: %s macro, %s earnings", len(econ), len(earns))
+
 async def cmd_events(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
-    pf = get_user_portfolio(uid)
+    pf = peek_user_portfolio(uid)
 
-    riga_tz = timezone(timedelta(hours=2))
-    now = datetime.now(riga_tz)
-    now_str = now.strftime("%d.%m.%Y %H:%M (Рига)")
+    now_str = _riga_minute_stamp()
 
-    async with aiohttp.ClientSession() as session:
-        econ = await get_economic_calendar(session, days=7)
-        earns = await get_earnings_calendar(session, days=7)
-        fg_val = await get_fear_greed_index(session)
+    session = await get_session()
+    econ, earns, fg_val = await asyncio.gather(
+        get_economic_calendar(session, days=7),
+        get_earnings_calendar(session, days=7),
+        get_fear_greed_index(session),
+    )
 
     text = format_events_block(econ, earns, pf, fg_val, now_str)
     await update.message.reply_text(text, parse_mode="HTML")
 
 async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        "ℹ️ <b>Помощь</b>\n\n"
-        "<b>Команды:</b>\n"
-        "• /start — главное меню\n"
-        "• /add TICKER КОЛ-ВО — быстро добавить актив в портфель\n\n"
-        "<b>Кнопки меню:</b>\n"
-        "• 💼 Мой портфель\n"
-        "• 🎯 Мои сделки\n"
-        "• 📊 Рыночные сигналы\n"
-        "• 📰 События недели\n"
-        "• 👤 Мой профиль\n"
-        "• ➕ Добавить актив\n"
-        "• 🆕 Новая сделка\n\n"
-        "<b>Алерты:</b>\n"
-        "• Резкие движения цены (в общий канал)\n"
-        "• Достижение твоей целевой прибыли (лично тебе)\n\n"
-        "<i>Это не финсовет</i>",
-        parse_mode="HTML",
-    )
+    await update.message.reply_text(HELP_TEXT, parse_mode="HTML")
+
+# подпись кнопки главного меню -> хендлер; диалоговые (добавить актив / новая сделка)
+# возвращают состояние ConversationHandler, поэтому результат всегда пробрасываем
+BUTTON_HANDLERS: Dict[str, Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[Any]]] = {
+    "💼 Мой портфель": cmd_portfolio,
+    "💹 Все цены": cmd_all_prices,
+    "🤖 AI-Советник": cmd_ask_ai,
+    "🎯 Мои сделки": cmd_my_trades,
+    "📊 Рыночные сигналы": cmd_market_signals,
+    "📰 События недели": cmd_events,
+    "➕ Добавить актив": cmd_add_asset,
+    "🆕 Новая сделка": cmd_new_trade,
+    "👤 Мой профиль": cmd_profile,
+    "ℹ️ Помощь": cmd_help,
+}
 
 async def handle_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = update.message.text
-
-    if text == "💼 Мой портфель":
-        await cmd_portfolio(update, context)
-    elif text == "💹 Все цены":
-        await cmd_all_prices(update, context)
-    elif text == "🤖 AI-Советник": 
-        await cmd_ask_ai(update, context)
-    elif text == "🎯 Мои сделки":
-        await cmd_my_trades(update, context)
-    elif text == "📊 Рыночные сигналы":
-        await cmd_market_signals(update, context)
-    elif text == "📰 События недели":
-        await cmd_events(update, context)
-    elif text == "➕ Добавить актив":
-        return await cmd_add_asset(update, context)
-    elif text == "🆕 Новая сделка":
-        return await cmd_new_trade(update, context)
-    elif text == "👤 Мой профиль":
-        await cmd_profile(update, context)
-    elif text == "ℹ️ Помощь":
-        await cmd_help(update, context)
+    handler = BUTTON_HANDLERS.get(update.message.text)
+    if handler:
+        return await handler(update, context)
 
 async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE):
-    print(f"❌ Error: {context.error}")
-    traceback.print_exc()
+    logger.error("❌ Error: %s", context.error, exc_info=context.error)
+
+# =========================================================
+# ==================== TELEGRAM TRANSPORT =================
+# =========================================================
+
+class OrjsonHTTPXRequest(HTTPXRequest):
+    """
+    HTTPXRequest с orjson для разбора ответов Bot API (getUpdates, sendMessage...).
+    Кодирование запросов PTB делает внутри RequestData через stdlib json —
+    публичной точки расширения там нет, так что меняем только декодер.
+    """
+
+    @staticmethod
+    def parse_json_payload(payload: bytes) -> Dict[str, Any]:
+        try:
+            return orjson.loads(payload)
+        except orjson.JSONDecodeError as exc:
+            logger.error("❌ invalid JSON from Telegram: %r", payload[:200])
+            raise TelegramError("Invalid server response") from exc
 
 # =========================================================
 # ================== HEALTH CHECK SERVER ==================
@@ -2533,114 +3428,173 @@ async def start_health_server(application: Application):
     site = web.TCPSite(runner, "0.0.0.0", port)
     await site.start()
 
-    print(f"✅ Health check server running on port {port}")
+    logger.info("✅ Health check server running on port %s", port)
     application.bot_data["health_runner"] = runner
 
 async def stop_health_server(application: Application):
     runner: Optional[web.AppRunner] = application.bot_data.get("health_runner")
     if runner:
-        print("🛑 Stopping health server...")
+        logger.info("🛑 Stopping health server...")
         try:
             await runner.cleanup()
-            print("  ✅ Health server stopped")
+            logger.info("  ✅ Health server stopped")
         except Exception as e:
-            print(f"  ⚠️ Error stopping health server: {e}")
+            logger.warning("  ⚠️ Error stopping health server: %s", e)
 
 # =========================================================
 # ================== APPLICATION LIFECYCLE ================
 # =========================================================
 
 async def app_post_init(application: Application):
-    print("🔁 post_init: loading data...")
+    logger.info("🔁 post_init: loading data...")
     await load_data_on_start()
-    print("🔁 post_init: data loaded")
+    logger.info("🔁 post_init: data loaded")
 
     # health server
     await start_health_server(application)
 
+    # база для алертов до старта джобы
+    await prime_alert_baseline()
+
+    # отправитель алертов из очереди
+    start_alert_sender(application)
+
+    # push-цены крипты между тиками джобы (алерты из стрима идут только в CHAT_ID)
+    if CHAT_ID:
+        start_binance_stream()
+
     # job_queue
     if CHAT_ID:
-        print("🔁 post_init: scheduling alerts job (10m)...")
+        logger.info("🔁 post_init: scheduling alerts job (10m)...")
     else:
-        print("🔁 post_init: CHAT_ID not set, summary price alerts disabled")
+        logger.info("🔁 post_init: CHAT_ID not set, summary price alerts disabled")
 
     application.job_queue.run_repeating(
         check_all_alerts,
-        interval=600,   # каждые 10 минут
+        interval=ALERT_INTERVAL,
         first=60,       # первая через минуту
         name="alerts_job",
     )
 
-    print("✅ post_init complete")
+    # календари событий: ключ кэша — дата UTC, поэтому греем сразу после её смены
+    if FINNHUB_API_KEY:
+        application.job_queue.run_daily(
+            refresh_calendar_job,
+            time=dt_time(0, 5, tzinfo=timezone.utc),
+            name="calendar_refresh_job",
+        )
+        application.job_queue.run_once(refresh_calendar_job, when=5, name="calendar_warmup")
+
+    logger.info("✅ post_init complete")
 
 async def app_post_stop(application: Application):
-    print("🛑 post_stop: shutdown started")
+    logger.info("🛑 post_stop: shutdown started")
 
     # останавливаем health server
     await stop_health_server(application)
 
+    # сначала глушим стрим, чтобы он не докидывал в очередь, потом досылаем алерты
+    await stop_binance_stream()
+    await stop_alert_sender()
+
     # ждём фоновые таски супабазы
     if active_tasks:
-        print(f"⏳ Waiting for {len(active_tasks)} background tasks...")
+        logger.info("⏳ Waiting for %s background tasks...", len(active_tasks))
         try:
             await asyncio.wait_for(
                 asyncio.gather(*active_tasks, return_exceptions=True),
                 timeout=30.0
             )
-            print("  ✅ All background tasks completed")
+            logger.info("  ✅ All background tasks completed")
         except asyncio.TimeoutError:
-            print("  ⚠️ Timeout waiting for tasks")
-
-    # локальное сохранение
-    try:
-        print("💾 Saving final state...")
-        price_cache.save()
-        save_portfolios_local()
-        save_trades_local()
-        print("  ✅ Local data saved")
-    except Exception as e:
-        print(f"  ⚠️ Error saving data: {e}")
-
-    # supabase session close
+            logger.warning("  ⚠️ Timeout waiting for tasks")
+
+    # локальное сохранение: три независимых файла пишем параллельно в потоках
+    logger.info("💾 Saving final state...")
+    savers = (price_cache.save, save_portfolios_local, save_trades_local)
+    results = await asyncio.gather(
+        *(asyncio.to_thread(fn) for fn in savers),
+        return_exceptions=True,
+    )
+    failed = 0
+    for fn, res in zip(savers, results):
+        if isinstance(res, Exception):
+            failed += 1
+            logger.warning("  ⚠️ Error saving data (%s): %s", fn.__name__, res)
+    if not failed:
+        logger.info("  ✅ Local data saved")
+
+    # общая HTTP-сессия
     try:
-        await supabase_storage.close()
-        print("  ✅ Supabase session closed")
+        await close_session()
+        logger.info("  ✅ HTTP session closed")
     except Exception as e:
-        print(f"  ⚠️ Error closing Supabase: {e}")
+        logger.warning("  ⚠️ Error closing HTTP session: %s", e)
 
-    print("👋 post_stop: done")
+    logger.info("👋 post_stop: done")
 
 # =========================================================
 # ========================== MAIN =========================
 # =========================================================
 
+# фильтры и паттерны маршрутизации: компилируем один раз при импорте
+TEXT_INPUT = filters.TEXT & ~filters.COMMAND
+PROFILE_PATTERN = re.compile(r"^profile_")
+VIEW_TOGGLE_PATTERN = re.compile(r"^view_toggle$")
+TRADE_PATTERN = re.compile(r"^trade_")
+PRICE_PATTERN = re.compile(r"^price_")
+ASSET_TYPE_PATTERN = re.compile(r"^asset_")
+ASSET_ITEM_PATTERN = re.compile(r"^add(ticker|crypto)_")
+NEW_TRADE_BUTTON = filters.Regex(re.compile(r"^🆕 Новая сделка$"))
+ADD_ASSET_BUTTON = filters.Regex(re.compile(r"^➕ Добавить актив$"))
+# хендлеры слушают только сообщения и нажатия inline-кнопок: остальные типы
+# апдейтов (edited_message, chat_member, ...) Telegram даже не присылает,
+# вместо того чтобы диспетчер будил на них корутины и отбрасывал
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
 def main():
-    print("============================================================")
-    print("🚀 Starting Trading Bot v6 (PTB21+)")
-    print("============================================================")
-    print(f"Python version: {sys.version}")
-    print("============================================================")
-    print("✅ Features:")
-    print("  • Hybrid storage (Supabase + local)")
-    print("  • Trades with profit targets & alerts")
-    print("  • Fear & Greed + RSI/MACD/SMA/Volume scoring")
-    print("  • Dynamic weekly events (macro, earnings, crypto sentiment)")
-    print("  • Better UI (bars, sections, emojis)")
-    print("  • Graceful shutdown w/ background task drain")
-    print("============================================================")
-    print(f"✅ BOT_TOKEN: {TOKEN[:10]}...")
-    print(f"✅ CHAT_ID: {CHAT_ID if CHAT_ID else 'Not set'}")
-    print(f"✅ DATA_DIR: {DATA_DIR}")
-    print(f"✅ TA_AVAILABLE: {TA_AVAILABLE}")
-    print("============================================================")
-
-    application = (
+    logger.info("============================================================")
+    logger.info("🚀 Starting Trading Bot v6 (PTB21+)")
+    logger.info("============================================================")
+    logger.info("Python version: %s", sys.version)
+    logger.info("============================================================")
+    logger.info("✅ Features:")
+    logger.info("  • Hybrid storage (Supabase + local)")
+    logger.info("  • Trades with profit targets & alerts")
+    logger.info("  • Fear & Greed + RSI/MACD/SMA/Volume scoring")
+    logger.info("  • Dynamic weekly events (macro, earnings, crypto sentiment)")
+    logger.info("  • Better UI (bars, sections, emojis)")
+    logger.info("  • Graceful shutdown w/ background task drain")
+    logger.info("============================================================")
+    logger.info("✅ BOT_TOKEN: %s...", TOKEN[:10])
+    logger.info("✅ CHAT_ID: %s", CHAT_ID if CHAT_ID else 'Not set')
+    logger.info("✅ DATA_DIR: %s", DATA_DIR)
+    logger.info("✅ TA_AVAILABLE: %s", TA_AVAILABLE)
+    logger.info("✅ UVLOOP_AVAILABLE: %s", UVLOOP_AVAILABLE)
+    logger.info("✅ RATE_LIMITER_AVAILABLE: %s", RATE_LIMITER_AVAILABLE)
+    logger.info("✅ NUMBA_AVAILABLE: %s", NUMBA_AVAILABLE)
+    logger.info("============================================================")
+
+    # политика должна стоять до того, как run_polling создаст loop
+    if UVLOOP_AVAILABLE:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+    builder = (
         ApplicationBuilder()
         .token(TOKEN)
+        # те же размеры пулов, что PTB ставит по умолчанию
+        .request(OrjsonHTTPXRequest(connection_pool_size=256))
+        .get_updates_request(OrjsonHTTPXRequest(connection_pool_size=1))
         .post_init(app_post_init)
         .post_stop(app_post_stop)
-        .build()
     )
+    # исходящие запросы к Bot API идут через очередь с лимитом 30/с:
+    # пачка алертов не упирается в 429, а RetryAfter переживаем ретраем
+    if RATE_LIMITER_AVAILABLE:
+        builder = builder.rate_limiter(
+            AIORateLimiter(overall_max_rate=30, overall_time_period=1, max_retries=3)
+        )
+    application = builder.build()
 
     # команды
     application.add_handler(CommandHandler("start", cmd_start))
@@ -2649,24 +3603,25 @@ def main():
     application.add_handler(CommandHandler("ask", cmd_ask_ai))
     
     # профиль
-    application.add_handler(CallbackQueryHandler(profile_select, pattern="^profile_"))
+    application.add_handler(CallbackQueryHandler(profile_select, pattern=PROFILE_PATTERN))
+    application.add_handler(CallbackQueryHandler(view_toggle, pattern=VIEW_TOGGLE_PATTERN))
 
     # диалог новой сделки
     trade_conv = ConversationHandler(
-        entry_points=[MessageHandler(filters.Regex("^🆕 Новая сделка$"), cmd_new_trade)],
+        entry_points=[MessageHandler(NEW_TRADE_BUTTON, cmd_new_trade)],
         states={
             SELECT_CRYPTO: [
-                CallbackQueryHandler(trade_select_crypto, pattern="^trade_")
+                CallbackQueryHandler(trade_select_crypto, pattern=TRADE_PATTERN)
             ],
             ENTER_AMOUNT: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, trade_enter_amount)
+                MessageHandler(TEXT_INPUT, trade_enter_amount)
             ],
             ENTER_PRICE: [
-                CallbackQueryHandler(trade_enter_price, pattern="^price_"),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, trade_enter_price),
+                CallbackQueryHandler(trade_enter_price, pattern=PRICE_PATTERN),
+                MessageHandler(TEXT_INPUT, trade_enter_price),
             ],
             ENTER_TARGET: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, trade_enter_target)
+                MessageHandler(TEXT_INPUT, trade_enter_target)
             ],
         },
         fallbacks=[CommandHandler("cancel", trade_cancel)],
@@ -2678,17 +3633,17 @@ def main():
     # диалог добавления актива
     add_asset_conv = ConversationHandler(
         entry_points=[
-            MessageHandler(filters.Regex("^➕ Добавить актив$"), cmd_add_asset)
+            MessageHandler(ADD_ASSET_BUTTON, cmd_add_asset)
         ],
         states={
             SELECT_ASSET_TYPE: [
-                CallbackQueryHandler(add_asset_select_type, pattern="^asset_")
+                CallbackQueryHandler(add_asset_select_type, pattern=ASSET_TYPE_PATTERN)
             ],
             SELECT_ASSET: [
-                CallbackQueryHandler(add_asset_select_item, pattern="^add(ticker|crypto)_")
+                CallbackQueryHandler(add_asset_select_item, pattern=ASSET_ITEM_PATTERN)
             ],
             ENTER_ASSET_AMOUNT: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, add_asset_enter_amount)
+                MessageHandler(TEXT_INPUT, add_asset_enter_amount)
             ],
         },
         fallbacks=[CommandHandler("cancel", add_asset_cancel)],
@@ -2699,15 +3654,19 @@ def main():
 
     # кнопки меню
     application.add_handler(
-        MessageHandler(filters.TEXT & ~filters.COMMAND, handle_buttons)
+        MessageHandler(TEXT_INPUT, handle_buttons)
     )
 
     # ошибки
     application.add_error_handler(on_error)
 
     # go
+    # long polling: Telegram держит getUpdates до 30 с и отвечает сразу при апдейте,
+    # в простое это ~2 запроса в минуту вместо одного каждые 10 с по умолчанию
     application.run_polling(
-        allowed_updates=Update.ALL_TYPES,
+        timeout=30,
+        poll_interval=0.0,
+        allowed_updates=ALLOWED_UPDATES,
         drop_pending_updates=True,
     )
 